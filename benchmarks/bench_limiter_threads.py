@@ -0,0 +1,105 @@
+"""
+Concurrency stress test and thread-scaling benchmark of the in-process
+rate limiter store.
+
+The stress test hammers a few hot keys, which share stripes, from many
+threads with a forced tiny switch interval, and fails if any key admits
+more requests than its quota (a lost update lets extra requests through)
+or fewer.
+
+The benchmark reports checks/s versus thread count over many keys, for a
+single lock (stripes=1) and the default lock striping.
+
+Usage:
+    python -m benchmarks.bench_limiter_threads [--threads 1,2,4,8,16] [--checks 200000]
+"""
+import argparse
+import sys
+import threading
+import time
+from utils.limiter import RateLimitStore
+
+
+def stress(threads: int, attempts: int, quota: int, stripes: int, keys: int = 4):
+    """
+    Returns:
+        list[int]: The requests admitted for each hot key, over all threads.
+    """
+    store = RateLimitStore(stripes=stripes)
+    admitted = [[0] * keys for _ in range(threads)]
+    barrier = threading.Barrier(threads)
+
+    def worker(index):
+        counts = admitted[index]
+        barrier.wait()
+        for attempt in range(attempts):
+            key = (index + attempt) % keys
+            if store.check(f"hot{key}", quota, 3600).allowed:
+                counts[key] += 1
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return [sum(counts[key] for counts in admitted) for key in range(keys)]
+
+
+def check_admitted(admitted: list[int], quota: int, stripes: int):
+    # Every attempt beyond the quota must have been rejected, and enough were made to use it all;
+    # raised rather than asserted so that python -O still checks
+    for key, count in enumerate(admitted):
+        if count > quota:
+            raise AssertionError(f"stripes={stripes}: hot{key} admitted {count}, over its quota of {quota}")
+        if count < quota:
+            raise AssertionError(f"stripes={stripes}: hot{key} admitted {count}, under its quota of {quota}")
+
+
+def throughput(threads: int, checks: int, keys: int, stripes: int):
+    store = RateLimitStore(max_keys=keys, stripes=stripes)
+    per_thread = checks // threads
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(index):
+        barrier.wait()
+        for i in range(per_thread):
+            store.check((index * per_thread + i) % keys, 1000, 60)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    return per_thread * threads / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", default="1,2,4,8,16")
+    parser.add_argument("--checks", type=int, default=200_000)
+    parser.add_argument("--keys", type=int, default=10_000)
+    args = parser.parse_args()
+    thread_counts = [int(n) for n in args.threads.split(",")]
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        quota = 1000
+        for stripes in (1, 16):
+            admitted = stress(max(thread_counts), 5000, quota, stripes)
+            print(f"stress stripes={stripes:<3} threads={max(thread_counts)}: admitted {admitted} of {quota} per key")
+            check_admitted(admitted, quota, stripes)
+    finally:
+        sys.setswitchinterval(interval)
+
+    print(f"{'threads':>7} {'stripes=1':>14} {'stripes=16':>14}  (checks/s)")
+    for threads in thread_counts:
+        single = throughput(threads, args.checks, args.keys, 1)
+        striped = throughput(threads, args.checks, args.keys, 16)
+        print(f"{threads:>7} {single:>14,.0f} {striped:>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
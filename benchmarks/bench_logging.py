@@ -0,0 +1,107 @@
+"""
+Benchmark of request latency with logging off, with synchronous handlers
+(the previous setup) and with the queued handlers of utils/logger.py.
+
+Drives GET /user_by_email/{email}/{org} in-process against a temporary
+SQLite database; each request writes several log lines from the endpoint
+and db.manage_user. Console output goes to /dev/null so the terminal is
+not part of the measurement; app.log is written in a temporary directory.
+--write-delay-ms adds a delay to every write to app.log, to stand in for
+slow or network-backed storage.
+
+Usage:
+    python -m benchmarks.bench_logging [--requests 2000] [--write-delay-ms 0]
+"""
+import argparse
+import logging
+import logging.config
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+workdir = tempfile.mkdtemp(prefix="px_bench_logging_")
+os.chdir(workdir)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+os.environ.setdefault("LOGIN_SECRET", "bench")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+from fastapi.testclient import TestClient  # noqa: E402
+import main  # noqa: E402
+from dtos.user_dto import UserDTO  # noqa: E402
+from db.manage_user import add_user  # noqa: E402
+from utils import logger as px_logger  # noqa: E402
+
+
+class SlowStream:
+    def __init__(self, stream, delay: float):
+        self.stream = stream
+        self.delay = delay
+
+    def write(self, data):
+        time.sleep(self.delay)
+        return self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        self.stream.close()
+
+
+def redirect_streams(write_delay: float):
+    devnull = open(os.devnull, "w")
+    for handler in logging.getLogger().handlers + list(getattr(px_logger._listener, "handlers", ())):
+        if type(handler) is logging.StreamHandler:
+            handler.setStream(devnull)
+        elif isinstance(handler, logging.FileHandler) and write_delay:
+            handler.stream = SlowStream(handler.stream, write_delay)
+
+
+def configure(mode: str, write_delay: float):
+    logging.disable(logging.NOTSET)
+    if mode == "queued":
+        px_logger.setup_logging(force=True)
+    else:
+        px_logger._stop_listener()
+        px_logger._listener = None
+        logging.config.dictConfig(px_logger.LOGGING_CONFIG)
+        if mode == "off":
+            logging.disable(logging.CRITICAL)
+    redirect_streams(write_delay)
+
+
+def measure(client, requests: int):
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        client.get("/user_by_email/bench@example.com/bench")
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return latencies
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--write-delay-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    add_user(UserDTO(first_name="Bench", last_name="User", email="bench@example.com", org="bench", password="bench"))
+    client = TestClient(main.app)
+
+    print(f"{args.requests} requests of GET /user_by_email, {args.write_delay_ms:g} ms per log write, latency in ms")
+    print(f"{'logging':>8} {'mean':>8} {'p50':>8} {'p99':>8}")
+    for mode in ("off", "sync", "queued"):
+        configure(mode, args.write_delay_ms / 1e3)
+        measure(client, 100)  # warm up
+        latencies = measure(client, args.requests)
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[int(len(latencies) * 0.99)]
+        print(f"{mode:>8} {statistics.mean(latencies) * 1e3:8.3f} {p50 * 1e3:8.3f} {p99 * 1e3:8.3f}", file=sys.stdout)
+    px_logger._stop_listener()
+
+
+if __name__ == "__main__":
+    main_()
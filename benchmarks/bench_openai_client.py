@@ -0,0 +1,97 @@
+"""
+Benchmark of upstream call latency with a new httpx.AsyncClient per call
+(the previous call_openai_api) against the shared pooled client of
+utils/openai_api.py.
+
+Runs dev/openai_mock.py in-process over plain HTTP and over TLS, and
+sends chat completion requests one at a time and with --concurrency in
+flight. The mock answers at once, so the difference is client setup
+(including loading CA certificates) and connection setup: TCP connect,
+and the TLS handshake over https. Against api.openai.com each
+new connection also pays DNS and several network round-trips.
+
+Usage:
+    python -m benchmarks.bench_openai_client [--calls 300] [--concurrency 20]
+"""
+import argparse
+import asyncio
+import os
+import ssl
+import statistics
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+import httpx  # noqa: E402
+from dev.openai_mock import start_in_thread  # noqa: E402
+from utils import openai_api  # noqa: E402
+
+PAYLOAD = {
+    "model": "gpt-4o",
+    "messages": [
+        {"role": "system", "content": openai_api.SYSTEM_PROMPT},
+        {"role": "user", "content": "Write a report based on the following input : Keywords of your thoughts"}
+    ],
+    "temperature": 0.3,
+    "max_tokens": 1000
+}
+
+
+async def measure(url: str, verify, calls: int, concurrency: int, pooled: bool):
+    """
+    Parameters:
+        verify (callable): Returns the client's verify argument.
+    """
+    limits = httpx.Limits(
+        max_connections=openai_api.OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=openai_api.OPENAI_MAX_KEEPALIVE,
+        keepalive_expiry=openai_api.OPENAI_KEEPALIVE_SECONDS
+    )
+    shared = httpx.AsyncClient(base_url=url, limits=limits, verify=verify()) if pooled else None
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call():
+        async with semaphore:
+            started = time.perf_counter()
+            if shared:
+                response = await shared.post("/chat/completions", json=PAYLOAD)
+            else:
+                # Like the previous code, every new client also loads its CA certificates
+                async with httpx.AsyncClient(base_url=url, verify=verify()) as client:
+                    response = await client.post("/chat/completions", json=PAYLOAD)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+
+    await call()  # warm up (and open the pooled connection)
+    latencies.clear()
+    started = time.perf_counter()
+    await asyncio.gather(*(call() for _ in range(calls)))
+    elapsed = time.perf_counter() - started
+    if shared:
+        await shared.aclose()
+    latencies.sort()
+    return statistics.mean(latencies), latencies[int(len(latencies) * 0.99)], calls / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{args.calls} calls of POST /chat/completions against dev/openai_mock.py, latency in ms")
+    print(f"{'scheme':>6} {'in flight':>9} {'client':>10} {'mean':>8} {'p99':>8} {'calls/s':>8}")
+    for tls in (False, True):
+        upstream = start_in_thread(tls=tls)
+        verify = (lambda: ssl.create_default_context(cafile=upstream.cafile)) if tls else (lambda: True)
+        for concurrency in (1, args.concurrency):
+            for pooled in (False, True):
+                mean, p99, rate = asyncio.run(measure(upstream.url, verify, args.calls, concurrency, pooled))
+                print(f"{'https' if tls else 'http':>6} {concurrency:>9} {'pooled' if pooled else 'per call':>10} "
+                      f"{mean * 1e3:8.2f} {p99 * 1e3:8.2f} {rate:8.0f}")
+        upstream.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Benchmark of the latency, throughput and memory that POST /query_openai_api
+adds on top of the upstream call.
+
+Starts dev/openai_mock.py and the app (uvicorn main:app) as separate
+processes, then sends the same chat completion both straight to the mock
+and through the app, one at a time and with --concurrency in flight. The
+difference between the two is the proxy's overhead: routing, validation,
+logging, the admission queue and the pooled upstream call.
+
+Memory per in-flight request is the growth of the app's resident memory
+(read from /proc, so Linux only) while --in-flight requests wait on a mock
+answering after --hold seconds, divided by their number.
+
+Usage:
+    python -m benchmarks.bench_openai_proxy [--requests 500] [--concurrency 50] [--latency fixed:0.05]
+        [--error-rate 0] [--rate-limit-rate 0] [--in-flight 200] [--hold 10]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAX_TOKENS = 50
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_listening(port: int, process: subprocess.Popen):
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args} exited with {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+
+
+def start(latency: str, error_rate: float, rate_limit_rate: float, workdir: str):
+    """
+    Starts the mock and the app pointed at it.
+
+    Returns:
+        tuple: The two processes and their base URLs.
+    """
+    mock_port, app_port = free_port(), free_port()
+    mock = subprocess.Popen(
+        [sys.executable, "-m", "dev.openai_mock", "--port", str(mock_port), "--latency", latency,
+         "--error-rate", str(error_rate), "--rate-limit-rate", str(rate_limit_rate), "--seed", "1"],
+        cwd=ROOT, stdout=subprocess.DEVNULL
+    )
+    env = {
+        **os.environ,
+        "PYTHONPATH": ROOT,
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "LOGIN_SECRET": "bench",
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{mock_port}/v1",
+        "LOG_LEVEL": "WARNING",
+        # Retries and injected errors are logged to the file only, to keep the table readable
+        "LOG_HANDLERS": "file",
+        "LOG_FILE": os.path.join(workdir, "app.log"),
+        # Measure the proxy, not the quotas and queue limits sized for the real API
+        "OPENAI_REQUESTS_PER_MINUTE": "1000000000",
+        "OPENAI_TOKENS_PER_MINUTE": "1000000000",
+        "OPENAI_MAX_IN_FLIGHT": "10000",
+        "OPENAI_MAX_CONNECTIONS": "10000",
+        "OPENAI_MAX_KEEPALIVE": "1000",
+    }
+    app = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(app_port), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL
+    )
+    wait_listening(mock_port, mock)
+    wait_listening(app_port, app)
+    return mock, app, f"http://127.0.0.1:{mock_port}/v1", f"http://127.0.0.1:{app_port}"
+
+
+def stop(*processes: subprocess.Popen):
+    for process in processes:
+        process.terminate()
+        process.wait()
+
+
+async def measure(url: str, path: str, body_for, requests: int, concurrency: int):
+    """
+    Returns:
+        tuple: Mean, p50 and p99 latency in seconds, requests per second and the number of errors.
+    """
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=120) as client:
+        async def call(i: int):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post(path, json=body_for(i))
+                latencies.append(time.perf_counter() - started)
+                if response.is_error or "error" in response.json():
+                    errors += 1
+
+        await asyncio.gather(*(call(i) for i in range(concurrency)))  # warm up the connections
+        latencies.clear()
+        errors = 0
+        started = time.perf_counter()
+        await asyncio.gather(*(call(i) for i in range(requests)))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return (statistics.mean(latencies), latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)],
+            requests / elapsed, errors)
+
+
+def rss_bytes(pid: int):
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    raise RuntimeError("VmRSS not found")
+
+
+async def memory_per_request(url: str, pid: int, in_flight: int):
+    # One more connection than held requests, for polling the stats
+    limits = httpx.Limits(max_connections=in_flight + 1, max_keepalive_connections=in_flight + 1)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=120) as client:
+        body = {"text": "warm up", "max_tokens": MAX_TOKENS}
+        await asyncio.gather(*(client.post("/query_openai_api", json=body) for _ in range(20)))
+        baseline = rss_bytes(pid)
+        calls = [asyncio.ensure_future(client.post("/query_openai_api", json={"text": f"held {i}", "max_tokens": MAX_TOKENS}))
+                 for i in range(in_flight)]
+        loaded = None
+        while loaded is None and not all(call.done() for call in calls):
+            if (await client.get("/openai_admission_stats")).json()["in_flight"] >= in_flight:
+                loaded = rss_bytes(pid)
+            await asyncio.sleep(0.05)
+        await asyncio.gather(*calls)
+    if loaded is None:
+        raise RuntimeError("The first requests finished before the last were sent; raise --hold")
+    return (loaded - baseline) / in_flight
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", default="fixed:0.05", help="mock latency distribution, see dev/openai_mock.py")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--in-flight", type=int, default=200)
+    parser.add_argument("--hold", type=float, default=10.0, help="mock latency while measuring memory, in seconds")
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix="px_bench_proxy_")
+
+    # Distinct texts, so that the app neither caches nor coalesces them
+    def direct_body(i: int):
+        return {"model": "gpt-4o", "messages": [{"role": "user", "content": f"request {i}"}], "max_tokens": MAX_TOKENS}
+
+    def proxy_body(i: int):
+        return {"text": f"request {i}", "max_tokens": MAX_TOKENS}
+
+    mock, app, mock_url, app_url = start(args.latency, args.error_rate, args.rate_limit_rate, workdir)
+    try:
+        print(f"{args.requests} requests, mock latency {args.latency}, latency in ms")
+        print(f"{'in flight':>9} {'path':>7} {'mean':>8} {'p50':>8} {'p99':>8} {'req/s':>7} {'errors':>6} {'added p50':>9}")
+        for concurrency in (1, args.concurrency):
+            direct = asyncio.run(measure(mock_url, "/chat/completions", direct_body, args.requests, concurrency))
+            proxy = asyncio.run(measure(app_url, "/query_openai_api", proxy_body, args.requests, concurrency))
+            for name, (mean, p50, p99, rate, errors) in (("direct", direct), ("proxy", proxy)):
+                added = f"{(p50 - direct[1]) * 1e3:9.2f}" if name == "proxy" else ""
+                print(f"{concurrency:>9} {name:>7} {mean * 1e3:8.2f} {p50 * 1e3:8.2f} {p99 * 1e3:8.2f} "
+                      f"{rate:7.0f} {errors:>6} {added:>9}")
+    finally:
+        stop(app, mock)
+
+    mock, app, _, app_url = start(f"fixed:{args.hold}", 0.0, 0.0, workdir)
+    try:
+        per_request = asyncio.run(memory_per_request(app_url, app.pid, args.in_flight))
+        print(f"app memory per in-flight request: {per_request / 1024:.1f} KiB ({args.in_flight} held for {args.hold:g} s)")
+    finally:
+        stop(app, mock)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark of time to first byte and total time of POST /query_openai_api,
+with and without streaming, against dev/openai_mock.py generating one
+token every --token-delay seconds. The app is served by uvicorn on a
+background thread, since TestClient buffers whole responses.
+
+Usage:
+    python -m benchmarks.bench_openai_stream [--requests 20] [--token-delay 0.02] [--max-tokens 50]
+"""
+import argparse
+import os
+import socket
+import statistics
+import tempfile
+import threading
+import time
+
+workdir = tempfile.mkdtemp(prefix="px_bench_stream_")
+os.chdir(workdir)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+os.environ.setdefault("LOGIN_SECRET", "bench")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from dev import openai_mock  # noqa: E402
+
+upstream = openai_mock.start_in_thread()
+os.environ["OPENAI_BASE_URL"] = upstream.url
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+import main  # noqa: E402
+
+
+def serve_app():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(main.app, log_level="warning"))
+    threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def measure(client, body: dict, requests: int):
+    first_bytes, totals = [], []
+    for _ in range(requests):
+        started = time.perf_counter()
+        with client.stream("POST", "/query_openai_api", json=body) as response:
+            first = None
+            for _ in response.iter_raw():
+                if first is None:
+                    first = time.perf_counter() - started
+        totals.append(time.perf_counter() - started)
+        first_bytes.append(first)
+    return statistics.mean(first_bytes), statistics.mean(totals)
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--max-tokens", type=int, default=50)
+    args = parser.parse_args()
+    openai_mock.TOKEN_DELAY = args.token_delay
+
+    print(f"{args.requests} requests of {args.max_tokens} tokens at {args.token_delay * 1e3:g} ms per token, mean ms")
+    print(f"{'mode':>10} {'first byte':>11} {'total':>8}")
+    server, url = serve_app()
+    with httpx.Client(base_url=url, timeout=60) as client:
+        for mode, extra in (("blocking", {}), ("sse", {"stream": True}), ("ndjson", {"stream": True, "stream_format": "ndjson"})):
+            first_byte, total = measure(client, {"max_tokens": args.max_tokens, **extra}, args.requests)
+            print(f"{mode:>10} {first_byte * 1e3:11.1f} {total * 1e3:8.1f}")
+    server.should_exit = True
+    upstream.stop()
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,126 @@
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.exc import IntegrityError
+from db.session_objects import Session, BulkImport
+
+logger = logging.getLogger('bulk_imports')
+
+
+def _utcnow():
+    # Whole seconds, so a claim time read back from a DATETIME column compares equal
+    return datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+
+
+def claim_bulk_import(kind: str, org: str, content_hash: str, stale_after: int, replay_for: int):
+    """
+    Claims the right to run a bulk import of the given content for the org.
+
+    Parameters:
+        kind (str): "users" or "addresses".
+        org (str): The org the upload is scoped to, or "" for mixed-org uploads.
+        content_hash (str): The sha256 hex digest of the uploaded file.
+        stale_after (int): Seconds without a heartbeat after which a running import is assumed to have died.
+        replay_for (int): Seconds after completing during which the import's result is returned
+            instead of running it again.
+
+    Returns:
+        tuple[str, int, dict | datetime | None]: The claim status and import id, plus the stored result
+            when the status is "completed", or the claim time to pass to heartbeat_bulk_import and
+            finish_bulk_import when it is "claimed". The status is "claimed" when the caller should run
+            the import, "running" when another request is already running it, or "completed" when it
+            completed less than replay_for seconds ago.
+    """
+    session = Session()
+    try:
+        record = (
+            session.query(BulkImport)
+            .filter_by(kind=kind, org=org, content_hash=content_hash)
+            .with_for_update()
+            .first()
+        )
+        now = _utcnow()
+        if record is None:
+            record = BulkImport(kind=kind, org=org, content_hash=content_hash, status="running", updated_at=now)
+            session.add(record)
+            try:
+                session.commit()
+            except IntegrityError:
+                # Another worker inserted the same import between our read and write
+                session.rollback()
+                record = session.query(BulkImport).filter_by(kind=kind, org=org, content_hash=content_hash).one()
+                return "running", record.id, None
+            return "claimed", record.id, now
+
+        if record.status == "completed" and record.updated_at > now - timedelta(seconds=replay_for):
+            return "completed", record.id, json.loads(record.result)
+        if record.status == "running" and record.updated_at > now - timedelta(seconds=stale_after):
+            return "running", record.id, None
+
+        logger.info("Re-running %s %s import %s for %s.", record.status, kind, record.id, org or 'all orgs')
+        record.status = "running"
+        record.result = None
+        record.updated_at = now
+        session.commit()
+        return "claimed", record.id, now
+    finally:
+        session.close()
+
+
+def heartbeat_bulk_import(import_id: int, claimed_at: datetime):
+    """
+    Refreshes the claim of a running import so it is not taken for dead.
+
+    Parameters:
+        import_id (int): The id returned by claim_bulk_import.
+        claimed_at (datetime): The claim time returned by claim_bulk_import or the last heartbeat.
+
+    Returns:
+        datetime | None: The new claim time, or None if the claim was lost: the import went
+            stale and another request claimed it, or it is no longer running.
+    """
+    now = _utcnow()
+    if now == claimed_at:
+        return claimed_at
+    session = Session()
+    try:
+        updated = (
+            session.query(BulkImport)
+            .filter_by(id=import_id, status="running", updated_at=claimed_at)
+            .update({"updated_at": now}, synchronize_session=False)
+        )
+        session.commit()
+        return now if updated else None
+    finally:
+        session.close()
+
+
+def finish_bulk_import(import_id: int, claimed_at: datetime, result: dict = None):
+    """
+    Records the outcome of a claimed bulk import, unless the claim was lost to another request.
+
+    Parameters:
+        import_id (int): The id returned by claim_bulk_import.
+        claimed_at (datetime): The claim time returned by claim_bulk_import or the last heartbeat.
+        result (dict, optional): The import summary, or None if the import failed.
+    """
+    session = Session()
+    try:
+        updated = (
+            session.query(BulkImport)
+            .filter_by(id=import_id, status="running", updated_at=claimed_at)
+            .update({
+                "status": "completed" if result is not None else "failed",
+                "result": json.dumps(result) if result is not None else None,
+                "updated_at": _utcnow(),
+            }, synchronize_session=False)
+        )
+        session.commit()
+        if not updated:
+            logger.warning("Bulk import %s was claimed by another request; not recording its outcome.", import_id)
+    except Exception as e:
+        session.rollback()
+        logger.error("Error recording bulk import %s: %s", import_id, e)
+    finally:
+        session.close()
+
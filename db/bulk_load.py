@@ -0,0 +1,219 @@
+import logging
+import os
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+from sqlalchemy import Column, Index, Integer, MetaData, String, Table, and_, exists, func, insert, select, text
+from db.session_objects import MYSQL_LOCAL_INFILE, User, engine
+
+logger = logging.getLogger('bulk_load')
+
+# bcrypt releases the GIL, so hashing scales with threads
+HASH_WORKERS = int(os.getenv("BULK_HASH_WORKERS", str(os.cpu_count() or 4)))
+
+STAGING_COLUMNS = ["line", "first_name", "last_name", "email", "org", "encrypted_password"]
+
+_hash_executor = None
+
+
+def hash_passwords(passwords: list[str]):
+    """
+    Hashes a batch of plaintext passwords with bcrypt on a shared thread pool.
+
+    Parameters:
+        passwords (list[str]): The plaintext passwords.
+
+    Returns:
+        list[str]: The bcrypt hashes, in the same order.
+    """
+    global _hash_executor
+    if _hash_executor is None:
+        _hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+    return list(_hash_executor.map(
+        lambda password: bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8'),
+        passwords
+    ))
+
+
+def _insert_new_users(columns: list[str], rows):
+    # INSERT ... SELECT skipping rows whose (email, org) another request created in the meantime
+    if engine.dialect.name == "mysql":
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        return mysql_insert(User).from_select(columns, rows).on_duplicate_key_update(id=User.id)
+    if engine.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as statement
+    else:
+        from sqlalchemy.dialects.postgresql import insert as statement
+    return statement(User).from_select(columns, rows).on_conflict_do_nothing(index_elements=["email", "org"])
+
+
+def _escape(value: str):
+    # Default LOAD DATA escaping: FIELDS ESCAPED BY '\\'
+    return (value.replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r").replace("\0", "\\0"))
+
+
+class UserBulkLoader:
+    """
+    Loads users into a staging table and merges them into users with one
+    set-based INSERT ... SELECT.
+
+    The staging tables are TEMPORARY, so they live only as long as the
+    loader's connection, and a crashed worker leaves none behind. MySQL
+    cannot refer to a temporary table twice in one query, so the first line
+    of each (email, org) is kept in a second one instead of self-joining.
+
+    On MySQL with MYSQL_LOCAL_INFILE enabled, staged rows are written to a
+    tab-separated file and loaded with LOAD DATA LOCAL INFILE. On other
+    databases (e.g. SQLite locally) rows are inserted into the staging table
+    with executemany, and the merge is the same.
+
+    Usage:
+        with UserBulkLoader() as loader:
+            for rows in chunks:
+                loader.stage(rows)
+            created = loader.merge(on_reject)
+    """
+
+    def __init__(self):
+        self.use_load_data = engine.dialect.name == "mysql" and MYSQL_LOCAL_INFILE
+        name = f"user_import_{uuid.uuid4().hex[:12]}"
+        metadata = MetaData()
+        self.staging = Table(
+            name, metadata,
+            Column("line", Integer, primary_key=True, autoincrement=False),
+            Column("first_name", String(100)),
+            Column("last_name", String(100)),
+            Column("email", String(100)),
+            Column("org", String(100)),
+            Column("encrypted_password", String(255)),
+            Index(f"ix_{name}_email_org", "email", "org", "line"),
+            prefixes=["TEMPORARY"]
+        )
+        self.first_lines = Table(
+            f"{name}_first", metadata,
+            Column("email", String(100)),
+            Column("org", String(100)),
+            Column("line", Integer),
+            Index(f"ix_{name}_first_email_org", "email", "org", unique=True),
+            prefixes=["TEMPORARY"]
+        )
+        self.connection = None
+        self.staging_file = None
+        self._created = []
+
+    def __enter__(self):
+        self.connection = engine.connect()
+        self._create(self.staging)
+        self.connection.commit()
+        if self.use_load_data:
+            self.staging_file = tempfile.NamedTemporaryFile(
+                "w", encoding="utf-8", suffix=".tsv", newline="\n", delete=False
+            )
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            self.connection.rollback()
+            # Pooled connections outlive the loader, so drop the temporary tables explicitly
+            for table in reversed(self._created):
+                table.drop(self.connection)
+            self.connection.commit()
+        finally:
+            self.connection.close()
+            if self.staging_file:
+                self.staging_file.close()
+                os.unlink(self.staging_file.name)
+
+    def _create(self, table: Table):
+        table.create(self.connection)
+        self._created.append(table)
+
+    def stage(self, rows: list[dict]):
+        """
+        Pre-hashes the passwords of a chunk of rows and adds them to the staging table.
+
+        Parameters:
+            rows (list[dict]): User rows with row, first_name, last_name, email, org and password.
+        """
+        hashes = hash_passwords([row["password"] for row in rows])
+        staged = [
+            {
+                "line": row["row"],
+                "first_name": row["first_name"],
+                "last_name": row["last_name"],
+                "email": row["email"],
+                "org": row["org"],
+                "encrypted_password": hashed
+            }
+            for row, hashed in zip(rows, hashes)
+        ]
+        if self.use_load_data:
+            for row in staged:
+                self.staging_file.write("\t".join(_escape(str(row[column])) for column in STAGING_COLUMNS) + "\n")
+        else:
+            self.connection.execute(insert(self.staging), staged)
+
+    def merge(self, on_reject):
+        """
+        Inserts the staged rows into users and reports the rows that were not imported.
+
+        A row is rejected when an earlier line of the same file has the same
+        email and org, or when a user with the same email and org already
+        exists, including one created by another request during the import.
+
+        Parameters:
+            on_reject (callable): Called as on_reject(line, email, org, reason) for every rejected row.
+
+        Returns:
+            int: The number of users created.
+        """
+        s, first = self.staging, self.first_lines
+        if self.use_load_data:
+            self.staging_file.close()
+            self.connection.execute(
+                text(
+                    f"LOAD DATA LOCAL INFILE :path INTO TABLE {s.name} CHARACTER SET utf8mb4 "
+                    "FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' "
+                    f"({', '.join(STAGING_COLUMNS)})"
+                ),
+                {"path": self.staging_file.name}
+            )
+
+        self._create(first)
+        self.connection.execute(insert(first).from_select(
+            ["email", "org", "line"],
+            select(s.c.email, s.c.org, func.min(s.c.line)).group_by(s.c.email, s.c.org)
+        ))
+
+        staged = s.join(first, and_(first.c.email == s.c.email, first.c.org == s.c.org))
+        first_line = s.c.line == first.c.line
+        existing_user = exists().where(and_(User.email == s.c.email, User.org == s.c.org))
+        self.connection.execute(_insert_new_users(
+            ["first_name", "last_name", "email", "org", "encrypted_password"],
+            select(s.c.first_name, s.c.last_name, s.c.email, s.c.org, s.c.encrypted_password)
+            .select_from(staged)
+            .where(first_line, ~existing_user)
+        ))
+
+        # Password hashes are salted, so a row was inserted only if its user has its hash
+        inserted = exists().where(and_(
+            User.email == s.c.email, User.org == s.c.org, User.encrypted_password == s.c.encrypted_password
+        ))
+        rejected = self.connection.execute(
+            select(s.c.line, s.c.email, s.c.org, first_line.label("first_line"))
+            .select_from(staged)
+            .where(~first_line | ~inserted)
+            .order_by(s.c.line)
+            .execution_options(stream_results=True, yield_per=1000)
+        )
+        rejected_count = 0
+        for line, email, org, is_first_line in rejected:
+            on_reject(line, email, org, "User already exists" if is_first_line else "Duplicate row in file")
+            rejected_count += 1
+
+        created = self.connection.scalar(select(func.count()).select_from(s)) - rejected_count
+        self.connection.commit()
+        logger.info("Bulk loaded %s users from %s.", created, s.name)
+        return created
@@ -1,6 +1,6 @@
 import logging
 import bcrypt
-from utils.limiter import rate_limiter
+from sqlalchemy import insert, select, tuple_
 from utils.logger import setup_logging
 from db.session_objects import Session, User, Address
 from dtos.address_dto import AddressDTO
@@ -10,7 +10,6 @@ setup_logging()
 logger = logging.getLogger('manage_user')
 
 
-@rate_limiter(max_requests=1, time_window=60)
 def get_user_by_id(user_id: int):
     """
     Return a User instance by its id.
@@ -55,10 +54,10 @@ def add_user(user: UserDTO):
 
         session.add(new_user)
         session.commit()
-        logger.info(f"User created with ID {new_user.id}")
+        logger.info("User created with ID %s", new_user.id)
     except Exception as e:
         session.rollback()
-        logger.error(f"Error creating user: {e}")
+        logger.error("Error creating user: %s", e)
         return None
     finally:
         session.close()
@@ -85,7 +84,7 @@ def add_user_address(user_id: int, street: str, city: str, state: str, zip_code:
     try:
         user = session.query(User).filter_by(id=user_id).first()
         if not user:
-            logger.info(f"No user found with ID {user_id}.")
+            logger.info("No user found with ID %s.", user_id)
             return {"error": "User not found"}
 
         new_address = Address(
@@ -99,16 +98,71 @@ def add_user_address(user_id: int, street: str, city: str, state: str, zip_code:
 
         session.add(new_address)
         session.commit()
-        logger.info(f"Address added for user ID {user_id}.")
+        logger.info("Address added for user ID %s.", user_id)
         return {"message": "Address added successfully", "address_id": new_address.id}
     except Exception as e:
         session.rollback()
-        logger.error(f"Error adding address for user ID {user_id}: {e}")
+        logger.error("Error adding address for user ID %s: %s", user_id, e)
         return {"error": "Failed to add address"}
     finally:
         session.close()
 
 
+def add_user_addresses_bulk(rows: list[dict]):
+    """
+    Adds addresses for many users in a single transaction.
+    Users are resolved by (email, org) with one lookup for the whole batch and
+    the addresses are written with a multi-row insert.
+
+    Parameters:
+        rows (list[dict]): Address rows containing email, org, street, city, state, zip_code and country.
+            An optional "row" key is passed through to the failure report.
+
+    Returns:
+        tuple[int, list[dict]]: The number of addresses added and the rows that failed, each with a reason.
+    """
+    session = Session()
+    try:
+        keys = {(row["email"], row["org"]) for row in rows}
+        user_ids = {
+            (email, org): user_id
+            for user_id, email, org in session.query(User.id, User.email, User.org)
+            .filter(tuple_(User.email, User.org).in_(keys))
+        }
+
+        new_addresses = []
+        failed_rows = []
+        for row in rows:
+            user_id = user_ids.get((row["email"], row["org"]))
+            if user_id is None:
+                failed_rows.append(_failed_address_row(row, "User not found"))
+                continue
+            new_addresses.append({
+                "user_id": user_id,
+                "street": row["street"],
+                "city": row["city"],
+                "state": row.get("state") or None,
+                "zip_code": row.get("zip_code") or None,
+                "country": row["country"]
+            })
+
+        if new_addresses:
+            session.execute(insert(Address), new_addresses)
+            session.commit()
+        logger.info("Added %s addresses, %s rows failed.", len(new_addresses), len(failed_rows))
+        return len(new_addresses), failed_rows
+    except Exception as e:
+        session.rollback()
+        logger.error("Error adding addresses in bulk: %s", e)
+        return 0, [_failed_address_row(row, "Failed to add address") for row in rows]
+    finally:
+        session.close()
+
+
+def _failed_address_row(row: dict, reason: str):
+    return {"row": row.get("row"), "email": row.get("email"), "org": row.get("org"), "reason": reason}
+
+
 def authenticate_user_password(email: str, password: str, org: str):
     """
     Authenticates a user by checking if the provided password matches
@@ -125,18 +179,18 @@ def authenticate_user_password(email: str, password: str, org: str):
     try:
         user = session.query(User).filter_by(email=email).filter_by(org=org).first()
         if not user:
-            logger.info(f"No user found with email {email} for {org}.")
+            logger.info("No user found with email %s for %s.", email, org)
             return False
 
         stored_hashed_password = user.encrypted_password
         if bcrypt.checkpw(password.encode('utf-8'), stored_hashed_password.encode('utf-8')):
-            logger.info("Authentication successful!")
+            logger.debug("Authentication successful!")
             return True
         else:
             logger.info("Authentication failed: Incorrect password.")
             return False
     except Exception as e:
-        logger.error(f"Error during authentication: {e}")
+        logger.error("Error during authentication: %s", e)
         return False
     finally:
         session.close()
@@ -159,14 +213,14 @@ def delete_user_by_email(email: str, org: str):
         if user:
             session.delete(user)
             session.commit()
-            logger.info(f"User with email {email} has been deleted.")
+            logger.info("User with email %s has been deleted.", email)
             return True
         else:
-            logger.info(f"No user found with email {email} for {org}.")
+            logger.info("No user found with email %s for %s.", email, org)
             return False
     except Exception as e:
         session.rollback()
-        logger.error(f"Error deleting user: {e}")
+        logger.error("Error deleting user: %s", e)
         return False
     finally:
         session.close()
@@ -190,14 +244,14 @@ def update_user_name_by_email(email: str, new_name: str, org: str = None):
         if user:
             user.first_name = new_name
             session.commit()
-            logger.info(f"User with email {email} has been updated to name {new_name}.")
+            logger.info("User with email %s has been updated to name %s.", email, new_name)
             return True
         else:
-            logger.info(f"No user found with email {email} for {org}.")
+            logger.info("No user found with email %s for %s.", email, org)
             return False
     except Exception as e:
         session.rollback()
-        logger.error(f"Error updating user: {e}")
+        logger.error("Error updating user: %s", e)
         return False
     finally:
         session.close()
@@ -217,16 +271,11 @@ def search_users_by_email(query: str, org: str):
     try:
         matching_users = session.query(User).filter(User.email.ilike(f"%{query}%"), User.org == org).all()
 
-        if matching_users:
-            logger.info(f"Found {len(matching_users)} users matching '{query}':")
-            for user in matching_users:
-                logger.info(f"ID: {user.id}, Name: {user.first_name}, Email: {user.email}")
-        else:
-            logger.info(f"No users found matching '{query}'.")
+        logger.info("Found %s users matching '%s' in %s.", len(matching_users), query, org)
 
         return matching_users
     except Exception as e:
-        logger.error(f"Error during search: {e}")
+        logger.error("Error during search: %s", e)
         return []
     finally:
         session.close()
@@ -247,7 +296,7 @@ def return_user_by_email(email: str, org: str = None):
     try:
         user = session.query(User).filter_by(email=email).filter_by(org=org).first()
         if user:
-            logger.info(f"User found with email {email} for {org}.")
+            logger.debug("User found with email %s for %s.", email, org)
             return UserDTO(
                 id=user.id,
                 first_name=user.first_name,
@@ -257,10 +306,10 @@ def return_user_by_email(email: str, org: str = None):
                 password="protected"
             )
         else:
-            logger.info(f"No user found with email {email} for {org}.")
+            logger.info("No user found with email %s for %s.", email, org)
             return None
     except Exception as e:
-        logger.error(f"Error retrieving user by email: {e}")
+        logger.error("Error retrieving user by email: %s", e)
         return None
     finally:
         session.close()
@@ -281,13 +330,50 @@ def get_user_id_by_email(email: str, org: str = None):
     try:
         user = session.query(User).filter_by(email=email).filter_by(org=org).first()
         if user:
-            logger.info(f"User ID {user.id} found for email {email} and {org}.")
+            logger.debug("User ID %s found for email %s and %s.", user.id, email, org)
             return user.id
         else:
-            logger.info(f"No user found with email {email}.")
+            logger.info("No user found with email %s.", email)
             return None
     except Exception as e:
-        logger.error(f"Error retrieving user ID by email: {e}")
+        logger.error("Error retrieving user ID by email: %s", e)
         return None
     finally:
         session.close()
+
+
+EXPORT_USER_COLUMNS = ["id", "first_name", "last_name", "email", "org", "created_at", "updated_at"]
+EXPORT_ADDRESS_COLUMNS = ["address_id", "street", "city", "state", "zip_code", "country"]
+
+
+def iter_users_by_org(org: str, include_addresses: bool = False, batch_size: int = 1000):
+    """
+    Streams every user of an organization in batches using a server-side cursor,
+    so memory use does not depend on the number of users.
+
+    Parameters:
+        org (str): The organization to export.
+        include_addresses (bool): Outer join addresses, yielding one row per address
+            (users without an address get one row with empty address columns).
+        batch_size (int): Number of rows fetched from the database per batch.
+
+    Yields:
+        list[dict]: The next batch of rows, ordered by user id. Passwords are never included.
+    """
+    columns = [User.id, User.first_name, User.last_name, User.email, User.org, User.created_at, User.updated_at]
+    if include_addresses:
+        columns += [Address.id.label("address_id"), Address.street, Address.city,
+                    Address.state, Address.zip_code, Address.country]
+    query = select(*columns).where(User.org == org)
+    if include_addresses:
+        query = query.outerjoin(Address, Address.user_id == User.id).order_by(User.id, Address.id)
+    else:
+        query = query.order_by(User.id)
+
+    session = Session()
+    try:
+        result = session.execute(query.execution_options(stream_results=True, yield_per=batch_size))
+        for partition in result.mappings().partitions():
+            yield [dict(row) for row in partition]
+    finally:
+        session.close()
@@ -0,0 +1,67 @@
+from datetime import date
+from sqlalchemy import func, select
+from db.session_objects import Session, OpenAiUsage, engine
+
+COUNTERS = ("requests", "prompt_tokens", "completion_tokens", "total_tokens")
+
+
+def _upsert():
+    # INSERT ... adding to the counters of an existing (org, model, day) row
+    if engine.dialect.name == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+        statement = insert(OpenAiUsage)
+        return statement.on_duplicate_key_update(
+            {**{name: getattr(OpenAiUsage, name) + getattr(statement.inserted, name) for name in COUNTERS},
+             "updated_at": func.now()}
+        )
+    if engine.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    statement = insert(OpenAiUsage)
+    return statement.on_conflict_do_update(
+        index_elements=["org", "model", "day"],
+        set_={**{name: getattr(OpenAiUsage, name) + getattr(statement.excluded, name) for name in COUNTERS},
+              "updated_at": func.now()}
+    )
+
+
+def add_usage(rows: list[dict]):
+    """
+    Adds usage counts to the per org, model and day totals in one statement.
+
+    Parameters:
+        rows (list[dict]): Rows with org, model, day and the COUNTERS to add.
+    """
+    if not rows:
+        return
+    session = Session()
+    try:
+        session.execute(_upsert(), rows)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def usage_for_org(org: str, since: date):
+    """
+    Returns:
+        list[dict]: The org's usage per model and day from since on, newest first.
+    """
+    session = Session()
+    try:
+        records = session.execute(
+            select(OpenAiUsage)
+            .where(OpenAiUsage.org == org, OpenAiUsage.day >= since)
+            .order_by(OpenAiUsage.day.desc(), OpenAiUsage.model)
+        ).scalars()
+        return [
+            {"model": record.model, "day": record.day.isoformat(),
+             **{name: getattr(record, name) for name in COUNTERS}}
+            for record in records
+        ]
+    finally:
+        session.close()
@@ -7,26 +7,35 @@ from sqlalchemy import (
         Column,
         Integer,
         String,
+        Text,
         DateTime,
+        Date,
+        BigInteger,
         func,
-        ForeignKey
+        ForeignKey,
+        UniqueConstraint
         )
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL environment variable is not set. Please define it in your .env file.")
-engine = create_engine(DATABASE_URL)
+# Allows the bulk user import to use LOAD DATA LOCAL INFILE (the server must enable local_infile too)
+MYSQL_LOCAL_INFILE = os.getenv("MYSQL_LOCAL_INFILE", "").lower() in ("1", "true", "yes")
+connect_args = {"local_infile": True} if MYSQL_LOCAL_INFILE and DATABASE_URL.startswith("mysql") else {}
+engine = create_engine(DATABASE_URL, connect_args=connect_args)
 # Base class for ORM models
 Base = declarative_base()
 
 # Define your ORM model corresponding to the "users" table.
 class User(Base):
     __tablename__ = 'users'
+    # Matches migration/v005_create_unique_email_org_index.sql
+    __table_args__ = (UniqueConstraint('email', 'org', name='unique_email_org'),)
     id = Column(Integer, primary_key=True)
     first_name = Column(String(100), nullable=False)
     last_name = Column(String(100), nullable=False)
-    email = Column(String(100), unique=True)
-    org = Column(String(100), unique=True)
+    email = Column(String(100))
+    org = Column(String(100))
     encrypted_password = Column(String(255))
     created_at = Column(DateTime, default=func.now(), nullable=False)  
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
@@ -50,5 +59,35 @@ class Address(Base):
     user = relationship("User", back_populates="addresses")
 
 
+class BulkImport(Base):
+    __tablename__ = 'bulk_imports'
+    __table_args__ = (UniqueConstraint('kind', 'org', 'content_hash', name='unique_bulk_import'),)
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(20), nullable=False)  # users or addresses
+    org = Column(String(100), nullable=False, default='')  # empty when not scoped to one org
+    content_hash = Column(String(64), nullable=False)  # sha256 of the uploaded file
+    status = Column(String(20), nullable=False)  # running, completed or failed
+    result = Column(Text, nullable=True)  # JSON summary of the completed import
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
+
+
+class OpenAiUsage(Base):
+    __tablename__ = 'openai_usage'
+    # Matches migration/v007_create_openai_usage.sql
+    __table_args__ = (UniqueConstraint('org', 'model', 'day', name='unique_openai_usage'),)
+
+    id = Column(Integer, primary_key=True)
+    org = Column(String(100), nullable=False, default='')  # empty for calls without a logged-in org
+    model = Column(String(100), nullable=False)
+    day = Column(Date, nullable=False)  # UTC
+    requests = Column(Integer, nullable=False, default=0)  # upstream calls
+    prompt_tokens = Column(BigInteger, nullable=False, default=0)
+    completion_tokens = Column(BigInteger, nullable=False, default=0)
+    total_tokens = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
+
+
 # Create a session factory
 Session = sessionmaker(bind=engine)
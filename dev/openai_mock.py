@@ -0,0 +1,244 @@
+"""
+A local stand-in for the OpenAI chat completions API, for exercising
+utils/openai_api.py without calling api.openai.com.
+
+POST /v1/chat/completions answers with a canned completion in the
+OpenAI response format, or as server-sent chunks when the request sets
+"stream": true. --latency delays each response (its first token when
+streaming) by a time drawn from a distribution, and --token-delay spaces
+out the tokens like a model generating them. --error-rate and
+--rate-limit-rate answer that fraction of requests with a 500, or a 429
+with Retry-After, in the OpenAI error format. With --tls the server uses
+a throwaway self-signed certificate (created with the openssl CLI), so
+that connection setup includes a TLS handshake like the real API does.
+
+Latency distributions, in seconds:
+    fixed:0.2               always 0.2
+    uniform:0.1,0.5         between 0.1 and 0.5
+    normal:0.3,0.1          mean 0.3, standard deviation 0.1
+    lognormal:0.3,0.5       median 0.3, sigma 0.5 (a long tail, like real model latency)
+
+Usage:
+    python -m dev.openai_mock --port 8100
+    python -m dev.openai_mock --latency lognormal:0.4,0.6 --error-rate 0.02 --rate-limit-rate 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8100/v1 uvicorn main:app
+
+Or from Python:
+    upstream = start_in_thread(port=0, tls=True)   # upstream.url, upstream.cafile
+    ...
+    upstream.stop()
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI()
+
+
+def parse_latency(spec: str):
+    """
+    Parses a latency distribution such as "fixed:0.2" or "lognormal:0.3,0.5".
+
+    Returns:
+        callable: Returns a latency in seconds (never negative) each time it is called.
+
+    Raises:
+        ValueError: If the distribution is unknown or its parameters are missing.
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(",") if value]
+    samplers = {
+        "fixed": (1, lambda value: value),
+        "uniform": (2, random.uniform),
+        "normal": (2, random.gauss),
+        "lognormal": (2, lambda median, sigma: median * math.exp(random.gauss(0, sigma))),
+    }
+    if kind not in samplers or len(values) != samplers[kind][0]:
+        raise ValueError(f"Unknown latency distribution {spec!r}; expected e.g. fixed:0.2 or lognormal:0.3,0.5")
+    sample = samplers[kind][1]
+    return lambda: max(sample(*values), 0.0)
+
+
+# Seconds per generated token; a whole completion takes this times its length
+TOKEN_DELAY = 0.0
+# Delay before each response, or its first token when streaming
+LATENCY = parse_latency("fixed:0")
+# Fractions of requests answered with a 500, and with a 429 asking to retry after RETRY_AFTER seconds
+ERROR_RATE = 0.0
+RATE_LIMIT_RATE = 0.0
+RETRY_AFTER = 1.0
+# Longest completion generated, in words
+COMPLETION_WORDS = 50
+# Requests answered per status code, for checking what the app under test did
+stats = {}
+
+
+def _completion_words(body: dict):
+    prompt_characters = sum(len(message.get("content", "")) for message in body.get("messages", []))
+    words = f"Mock response to {prompt_characters} characters.".split()
+    count = max(len(words), min(body.get("max_tokens", COMPLETION_WORDS), COMPLETION_WORDS))
+    words += [f"word{i}" for i in range(len(words), count)]
+    return prompt_characters, [word if i == 0 else f" {word}" for i, word in enumerate(words)]
+
+
+def _usage(prompt_characters: int, words: list[str]):
+    prompt_tokens = prompt_characters // 4 + 1
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": len(words), "total_tokens": prompt_tokens + len(words)}
+
+
+async def _stream_chunks(completion_id: str, model: str, words: list[str], usage: dict = None):
+    base = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+    yield f"data: {json.dumps({**base, 'choices': [{'index': 0, 'delta': {'role': 'assistant'}, 'finish_reason': None}]})}\n\n"
+    for word in words:
+        if TOKEN_DELAY:
+            await asyncio.sleep(TOKEN_DELAY)
+        yield f"data: {json.dumps({**base, 'choices': [{'index': 0, 'delta': {'content': word}, 'finish_reason': None}]})}\n\n"
+    yield f"data: {json.dumps({**base, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})}\n\n"
+    if usage:
+        # Sent when the request sets stream_options.include_usage, like the real API
+        yield f"data: {json.dumps({**base, 'choices': [], 'usage': usage})}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def _error(status_code: int, message: str, error_type: str, code: str, headers: dict = None):
+    stats[status_code] = stats.get(status_code, 0) + 1
+    return JSONResponse({"error": {"message": message, "type": error_type, "param": None, "code": code}},
+                        status_code=status_code, headers=headers)
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    roll = random.random()
+    if roll < RATE_LIMIT_RATE:
+        return _error(429, "Rate limit reached (mock).", "requests", "rate_limit_exceeded",
+                      {"Retry-After": f"{RETRY_AFTER:g}"})
+    if roll < RATE_LIMIT_RATE + ERROR_RATE:
+        return _error(500, "The server had an error while processing your request (mock).", "server_error", None)
+    stats[200] = stats.get(200, 0) + 1
+
+    latency = LATENCY()
+    if latency:
+        await asyncio.sleep(latency)
+    prompt_characters, words = _completion_words(body)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    model = body.get("model", "gpt-4o")
+    usage = _usage(prompt_characters, words)
+    if body.get("stream"):
+        include_usage = (body.get("stream_options") or {}).get("include_usage")
+        return StreamingResponse(_stream_chunks(completion_id, model, words, usage if include_usage else None),
+                                 media_type="text/event-stream")
+
+    if TOKEN_DELAY:
+        await asyncio.sleep(TOKEN_DELAY * len(words))
+    content = "".join(words)
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+        ],
+        "usage": usage
+    }
+
+
+def create_certificate(directory: str):
+    """
+    Writes a self-signed certificate for 127.0.0.1 and localhost.
+
+    Returns:
+        tuple[str, str]: Paths of the certificate and the key.
+    """
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-keyout", key, "-out", cert, "-subj", "/CN=localhost",
+         "-addext", "subjectAltName=IP:127.0.0.1,DNS:localhost"],
+        check=True, capture_output=True
+    )
+    return cert, key
+
+
+class MockUpstream:
+    def __init__(self, host: str = "127.0.0.1", port: int = 8100, tls: bool = False):
+        self.host = host
+        self.port = port
+        self.cafile = None
+        self._keyfile = None
+        if tls:
+            self.cafile, self._keyfile = create_certificate(tempfile.mkdtemp(prefix="px_openai_mock_"))
+        self._server = None
+
+    @property
+    def url(self):
+        return f"{'https' if self.cafile else 'http'}://{self.host}:{self.port}/v1"
+
+    def run(self, started: threading.Event = None):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # Inherited by accepted connections; without it Nagle's algorithm and delayed ACKs
+        # add ~40 ms to every response on a reused connection
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.bind((self.host, self.port))
+        self.port = sock.getsockname()[1]
+        config = uvicorn.Config(app, log_level="warning", ssl_certfile=self.cafile, ssl_keyfile=self._keyfile)
+        self._server = uvicorn.Server(config)
+        if started:
+            threading.Thread(target=self._notify_started, args=(started,), daemon=True).start()
+        self._server.run(sockets=[sock])
+
+    def _notify_started(self, started: threading.Event):
+        while not self._server.started:
+            time.sleep(0.01)
+        started.set()
+
+    def stop(self):
+        if self._server:
+            self._server.should_exit = True
+
+
+def start_in_thread(host: str = "127.0.0.1", port: int = 0, tls: bool = False):
+    """
+    Starts a mock upstream on a background thread and returns it once it is listening.
+    """
+    upstream = MockUpstream(host, port, tls)
+    started = threading.Event()
+    threading.Thread(target=upstream.run, args=(started,), daemon=True).start()
+    started.wait()
+    return upstream
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--tls", action="store_true")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds per generated token")
+    parser.add_argument("--latency", default="fixed:0", help="delay before each response, e.g. lognormal:0.3,0.5")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After of the 429s, in seconds")
+    parser.add_argument("--seed", type=int, help="seed for repeatable latencies and errors")
+    args = parser.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+    TOKEN_DELAY = args.token_delay
+    LATENCY = parse_latency(args.latency)
+    ERROR_RATE, RATE_LIMIT_RATE, RETRY_AFTER = args.error_rate, args.rate_limit_rate, args.retry_after
+    upstream = MockUpstream(args.host, args.port, args.tls)
+    print(f"OpenAI mock listening on {upstream.url}" + (f" (CA file {upstream.cafile})" if upstream.cafile else ""))
+    upstream.run()
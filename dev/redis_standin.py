@@ -0,0 +1,193 @@
+"""
+A local stand-in for a Redis server, for exercising RedisStore without
+running Redis.
+
+It speaks enough of the Redis protocol for redis-py (PING, CLIENT, SELECT,
+GET, SET, DEL, TIME, FLUSHALL, SCRIPT LOAD/EXISTS/FLUSH, EVAL, EVALSHA).
+Lua is not interpreted: scripts this project sends are recognized by
+their SHA1 and run by an equivalent Python implementation, and any other
+script is rejected.
+
+Usage:
+    python -m dev.redis_standin --port 6390
+    RATE_LIMIT_BACKEND=redis RATE_LIMIT_REDIS_URL=redis://127.0.0.1:6390/0 uvicorn main:app
+
+Or from Python:
+    server = start_in_thread(port=0)   # server.port is the bound port
+    ...
+    server.stop()
+"""
+import argparse
+import asyncio
+import hashlib
+import math
+import threading
+import time
+from utils.limiter_backends import GCRA_SCRIPT
+
+
+class StandinServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 6390):
+        self.host = host
+        self.port = port
+        self.data = {}  # key -> (value, expires_at or None)
+        self.scripts = {hashlib.sha1(GCRA_SCRIPT.encode()).hexdigest(): self._gcra}
+        self.loaded = set()
+        self._server = None
+        self._loop = None
+
+    # -- storage -----------------------------------------------------------
+
+    def _get(self, key):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self.data[key]
+            return None
+        return value
+
+    def _set(self, key, value, px=None):
+        self.data[key] = (value, time.time() + px / 1000 if px else None)
+
+    def _gcra(self, keys, args):
+        # Mirrors GCRA_SCRIPT; commands are handled one at a time, so this is atomic
+        now = time.time()
+        interval, window = float(args[0]), float(args[1])
+        stored = self._get(keys[0])
+        tat = float(stored) if stored is not None else now
+        if tat < now:
+            tat = now
+        new_tat = tat + interval
+        allow_at = new_tat - window
+        if allow_at > now:
+            return [0, 0, repr(allow_at - now).encode(), repr(tat - now).encode()]
+        self._set(keys[0], repr(new_tat).encode(), math.ceil((new_tat - now) * 1000))
+        return [1, math.floor((now - allow_at) / interval), b"0", repr(new_tat - now).encode()]
+
+    # -- commands ----------------------------------------------------------
+
+    def execute(self, command):
+        name = command[0].decode().upper()
+        args = command[1:]
+        if name == "PING":
+            return ("simple", "PONG")
+        if name in ("CLIENT", "SELECT"):
+            return ("simple", "OK")
+        if name == "GET":
+            return self._get(args[0])
+        if name == "SET":
+            px = None
+            for option, value in zip(args[2::2], args[3::2]):
+                if option.upper() == b"PX":
+                    px = int(value)
+                elif option.upper() == b"EX":
+                    px = int(value) * 1000
+            self._set(args[0], args[1], px)
+            return ("simple", "OK")
+        if name == "DEL":
+            return sum(1 for key in args if self.data.pop(key, None) is not None)
+        if name == "FLUSHALL":
+            self.data.clear()
+            return ("simple", "OK")
+        if name == "TIME":
+            now = time.time()
+            return [str(int(now)).encode(), str(int(now % 1 * 1_000_000)).encode()]
+        if name == "SCRIPT":
+            sub = args[0].decode().upper()
+            if sub == "LOAD":
+                sha = hashlib.sha1(args[1]).hexdigest()
+                if sha not in self.scripts:
+                    return ("error", "ERR this stand-in only runs the scripts it knows")
+                self.loaded.add(sha)
+                return sha.encode()
+            if sub == "EXISTS":
+                return [1 if sha.decode() in self.loaded else 0 for sha in args[1:]]
+            if sub == "FLUSH":
+                self.loaded.clear()
+                return ("simple", "OK")
+        if name in ("EVAL", "EVALSHA"):
+            sha = hashlib.sha1(args[0]).hexdigest() if name == "EVAL" else args[0].decode()
+            if name == "EVAL" and sha in self.scripts:
+                self.loaded.add(sha)
+            if sha not in self.loaded:
+                return ("error", "NOSCRIPT No matching script. Please use EVAL.")
+            numkeys = int(args[1])
+            return self.scripts[sha](args[2:2 + numkeys], args[2 + numkeys:])
+        return ("error", f"ERR unknown command '{name}'")
+
+    # -- protocol ----------------------------------------------------------
+
+    @classmethod
+    def encode(cls, reply):
+        if reply is None:
+            return b"$-1\r\n"
+        if isinstance(reply, tuple):
+            kind, text = reply
+            return (b"+" if kind == "simple" else b"-") + text.encode() + b"\r\n"
+        if isinstance(reply, bool) or isinstance(reply, int):
+            return b":%d\r\n" % int(reply)
+        if isinstance(reply, bytes):
+            return b"$%d\r\n%s\r\n" % (len(reply), reply)
+        if isinstance(reply, list):
+            return b"*%d\r\n" % len(reply) + b"".join(cls.encode(item) for item in reply)
+        raise TypeError(f"Cannot encode {reply!r}")
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.startswith(b"*"):
+                    command = line.split()  # inline command
+                else:
+                    command = []
+                    for _ in range(int(line[1:])):
+                        length = int((await reader.readline())[1:])
+                        command.append((await reader.readexactly(length + 2))[:-2])
+                if command:
+                    writer.write(self.encode(self.execute(command)))
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, started: threading.Event = None):
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        if started:
+            started.set()
+        async with self._server:
+            try:
+                await self._server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+    def stop(self):
+        if self._loop and self._server:
+            self._loop.call_soon_threadsafe(self._server.close)
+
+
+def start_in_thread(host: str = "127.0.0.1", port: int = 0):
+    """
+    Starts a stand-in server on a background thread and returns it once it is listening.
+    """
+    server = StandinServer(host, port)
+    started = threading.Event()
+    threading.Thread(target=lambda: asyncio.run(server.serve(started)), daemon=True).start()
+    started.wait()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+    server = StandinServer(args.host, args.port)
+    print(f"Redis stand-in listening on {args.host}:{args.port}")
+    asyncio.run(server.serve())
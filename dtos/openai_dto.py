@@ -1,3 +1,4 @@
+from typing import List, Optional
 from pydantic import BaseModel
 
 class OpenAiDTO(BaseModel):
@@ -6,4 +7,22 @@ class OpenAiDTO(BaseModel):
     text: str = "Keywords of your thoughts"  # Text to be processed by the AI
     temperature: float = 0.3  # Default temperature for the response
     max_tokens: int = 1000  # Default max tokens for the response
+    stream: bool = False  # Send the response as it is generated
+    stream_format: str = "sse"  # "sse" (text/event-stream) or "ndjson" (application/x-ndjson)
+    cache: Optional[bool] = None  # None: cache at temperature 0 only; True: allow at any temperature; False: bypass
 
+
+
+class OpenAiBatchItemDTO(BaseModel):
+    prompt: str = "Write a report based on the following input"  # Prompt for the AI
+    text: str  # Text to be processed by the AI
+    id: Optional[str] = None  # Caller's reference, echoed in the item's result
+
+
+class OpenAiBatchDTO(BaseModel):
+    model: str = "gpt-4o"  # Model for every item
+    temperature: float = 0.3  # Temperature for every item
+    max_tokens: int = 1000  # Max tokens for each item's response
+    items: List[OpenAiBatchItemDTO]  # Requests to run
+    concurrency: int = 8  # Items sent upstream at once, capped by OPENAI_BATCH_CONCURRENCY
+    cache: Optional[bool] = None  # As for OpenAiDTO, applied to every item
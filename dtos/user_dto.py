@@ -1,7 +1,8 @@
+from typing import Optional
 from pydantic import BaseModel
 
 class UserDTO(BaseModel):
-    id: int
+    id: Optional[int] = None
     first_name: str
     last_name: str
     email: str
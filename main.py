@@ -1,13 +1,14 @@
-from fastapi import FastAPI, Depends, Form
+from fastapi import FastAPI, Depends, Form, HTTPException, Request
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi_login import LoginManager
 from fastapi_login.exceptions import InvalidCredentialsException
 import logging
 from utils.logger import setup_logging
+from utils.auth import LOGIN_SECRET, check_org, login_org, manager, request_org
 from utils.bulk_upload import router
+from utils.bulk_export import router as export_router
 from dtos.user_dto import UserDTO
 from dtos.address_dto import AddressDTO
-from dtos.openai_dto import OpenAiDTO
+from dtos.openai_dto import OpenAiBatchDTO, OpenAiDTO
 from db.manage_user import (
     add_user,
     add_user_address,
@@ -21,48 +22,88 @@ from db.manage_user import (
 )
 from db.session_objects import Base, engine
 from fastapi.middleware.cors import CORSMiddleware
-from utils.openai_api import call_openai_api
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from utils.openai_api import (
+    MalformedResponse,
+    OPENAI_BATCH_CONCURRENCY,
+    OPENAI_BATCH_MAX_ITEMS,
+    batch_openai_api,
+    call_openai_api,
+    close_openai_client,
+    iter_batch_ndjson,
+    iter_ndjson,
+    iter_sse,
+    open_openai_client,
+    openai_admission,
+    openai_breakers,
+    openai_flights,
+    retry_after_seconds,
+    stream_openai_api
+)
+from utils.admission import AdmissionRejected
+from utils.circuit_breaker import CircuitOpen
+from utils.tokens import PromptTooLong
+from utils.usage import openai_usage
+from db.openai_usage import add_usage, usage_for_org
+from utils.openai_cache import response_cache
+from utils.limiter import RateLimitPolicy, RateLimitExceeded, by_arg, by_client_ip, by_org, by_token_subject, close_rate_limit_store
+from utils.rate_limit_middleware import RateLimitMiddleware
+from utils.request_logging_middleware import RequestLoggingMiddleware
 from dotenv import load_dotenv
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+import httpx
+import math
 import os
 
 load_dotenv()
 
-# Secret key for session management
-LOGIN_SECRET = os.getenv("LOGIN_SECRET")
-if not LOGIN_SECRET:
-    raise RuntimeError("LOGIN_SECRET environment variable is not set. Please define it in your .env file.")
-
 # Initialize the database schema
 Base.metadata.create_all(bind=engine)
 
 setup_logging()
 logger = logging.getLogger('px')
 
-manager = LoginManager(LOGIN_SECRET, token_url="/login")
+# Requests per minute for one user, and for all users of one org together
+USER_RATE_LIMIT = int(os.getenv("RATE_LIMIT_USER_PER_MINUTE", "60"))
+ORG_RATE_LIMIT = int(os.getenv("RATE_LIMIT_ORG_PER_MINUTE", "600"))
 
-@manager.user_loader()
-def load_user(email: str, org: str):
-    """
-    Load user from the database using their email and org.
+# Logged-in users (emails) whose AI requests are queued first
+PREMIUM_USERS = {email.strip() for email in os.getenv("OPENAI_PREMIUM_USERS", "").split(",") if email.strip()}
 
-    Parameters:
-        email (str): The email of the user.
-        org (str): The organization of the user.
+# Rate limit policies by route, narrowest first; rejected requests get a 429
+RATE_LIMIT_POLICIES = {
+    "/login": [RateLimitPolicy("login_ip", USER_RATE_LIMIT, 60, by_client_ip())],
+    "/users/{user_id}": [RateLimitPolicy("read_user", 1, 60, by_arg("user_id"))],
+    "/users/{email}/{password}/{org}": [
+        RateLimitPolicy("authenticate_user", USER_RATE_LIMIT, 60, by_arg("email", "org")),
+        RateLimitPolicy("authenticate_org", ORG_RATE_LIMIT, 60, by_org())
+    ],
+    "/search_users_by_name/{query}/{org}": [
+        RateLimitPolicy("search_ip", USER_RATE_LIMIT, 60, by_client_ip()),
+        RateLimitPolicy("search_org", ORG_RATE_LIMIT, 60, by_org())
+    ],
+}
 
-    Returns:
-        dict or None: The user object if found, otherwise None.
-    """
-    logger.info(f"Attempting to load user with email: {email} for {org}")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled client to the OpenAI API per worker, closed on shutdown
+    await open_openai_client()
+    # Token usage is summed in memory and written to openai_usage in batches
+    openai_usage.start(add_usage)
+    yield
+    await openai_usage.stop()
+    await close_openai_client()
+    # Redis connections the rate limiter opened on this loop
+    await close_rate_limit_store()
 
-    user = return_user_by_email(email, org)
-    if user:
-        logger.info(f"User found: {user.email} in {org}")
-        return user.email
-    logger.warning(f"No user found for {org}")
-    return None
 
 # FastAPI app setup
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+# Added before CORS so that 429 responses still carry CORS headers
+app.add_middleware(RateLimitMiddleware, policies=RATE_LIMIT_POLICIES)
 
 app.add_middleware(
     CORSMiddleware,
@@ -75,7 +116,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so the summary line covers every response, including 429s
+app.add_middleware(RequestLoggingMiddleware)
+
 app.include_router(router)
+app.include_router(export_router)
 
 @app.post("/login")
 def login(data: OAuth2PasswordRequestForm = Depends(), org: str = Form(...)):
@@ -93,13 +138,13 @@ def login(data: OAuth2PasswordRequestForm = Depends(), org: str = Form(...)):
     email = data.username
     password = data.password
 
-    logger.info(f"Validating user: {email} for organization: {org}")
+    logger.debug("Validating user: %s for organization: %s", email, org)
     if not authenticate_user_password(email, password, org):
         raise InvalidCredentialsException
 
-    # Create the token with the user's email as the subject
-    access_token = manager.create_access_token(data={"sub": email})
-    logger.info(f"Generated access_token for {email}: {access_token}")  # Log the access token
+    # Create the token with the user's email as the subject; the org attributes their AI usage
+    access_token = manager.create_access_token(data={"sub": email, "org": org})
+    logger.debug("Generated access_token for %s", email)
 
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -114,7 +159,7 @@ def read_user(user_id: int):
     Returns:
         dict: The user object.
     """
-    logger.info(f"Retrieving user with ID: {user_id}")
+    logger.debug("Retrieving user with ID: %s", user_id)
     return {"user": get_user_by_id(user_id)}
 
 @app.post("/users_create")
@@ -128,7 +173,7 @@ def create_user(user: UserDTO):
     Returns:
         dict: The created user object.
     """
-    logger.info(f"Adding user: {user.first_name}, {user.email}")
+    logger.debug("Adding user: %s, %s", user.first_name, user.email)
     return {"user": add_user(user)}
 
 @app.delete("/user_delete/{email}/{org}")
@@ -143,7 +188,7 @@ def delete_user(email: str, org: str):
     Returns:
         dict: Success status of the deletion.
     """
-    logger.info(f"Deleting user with email: {email} for organization: {org}")
+    logger.debug("Deleting user with email: %s for organization: %s", email, org)
     return {"success": delete_user_by_email(email, org)}
 
 @app.post("/user_update_name/{email}/{new_name}/{org}")
@@ -159,7 +204,7 @@ def update_user_name(email: str, new_name: str, org: str):
     Returns:
         dict: Success status of the update.
     """
-    logger.info(f"Updating first_name of {email} for {org} to {new_name}")
+    logger.debug("Updating first_name of %s for %s to %s", email, org, new_name)
     return {"success": update_user_name_by_email(email, new_name, org)}
 
 @app.get("/search_users_by_name/{query}/{org}")
@@ -174,7 +219,7 @@ def find_users_by_email(query: str, org: str):
     Returns:
         dict: A list of matching users.
     """
-    logger.info(f"Finding users with emails that contain: {query} for organization: {org}")
+    logger.debug("Finding users with emails that contain: %s for organization: %s", query, org)
     return {"users": search_users_by_email(query, org)}
 
 @app.get("/users/{email}/{password}/{org}")
@@ -190,7 +235,7 @@ def authenticate_user(email: str, password: str, org: str):
     Returns:
         dict: Success status of the authentication.
     """
-    logger.info(f"Validating user: {email} for organization: {org}")
+    logger.debug("Validating user: %s for organization: %s", email, org)
     return {"success": authenticate_user_password(email, password, org)}
 
 @app.post("/add_user_address")
@@ -208,7 +253,7 @@ def add_user_address_endpoint(
     Returns:
         dict: Success message and address details.
     """
-    logger.info(f"Authenticated user: {user}")  # Log the authenticated user
+    logger.debug("Authenticated user: %s", user)
 
     # Get the user_id for the authenticated user
     user_id = get_user_id_by_email(user)
@@ -224,7 +269,7 @@ def add_user_address_endpoint(
         address.zip_code,
         address.country
     )
-    logger.info(f"add_user_address result: {result}")
+    logger.debug("add_user_address result: %s", result)
     return {
         "message": "Address added successfully.",
         "result": result
@@ -242,7 +287,7 @@ def get_user_by_email(email: str, org: str):
     Returns:
         dict: The user object if found, otherwise an error message.
     """
-    logger.info(f"Retrieving user with email: {email} for organization: {org}")
+    logger.debug("Retrieving user with email: %s for organization: %s", email, org)
     user = return_user_by_email(email, org)
     if user:
         return {
@@ -254,16 +299,142 @@ def get_user_by_email(email: str, org: str):
             "org": user.org
         }
     else:
-        logger.warning(f"No user found with email: {email} for organization: {org}")
+        logger.warning("No user found with email: %s for organization: %s", email, org)
+
+
+token_subject = by_token_subject(LOGIN_SECRET)
+
+
+def request_tier(request: Request):
+    """
+    The priority tier of a request: "anonymous" without a valid bearer token,
+    "premium" for users in OPENAI_PREMIUM_USERS, otherwise "regular".
+    """
+    subject = token_subject({"request": request})
+    if not subject:
+        return "anonymous"
+    return "premium" if subject in PREMIUM_USERS else "regular"
 
 
 @app.post("/query_openai_api")
-async def query_openai_api(openai_dto: OpenAiDTO):
+async def query_openai_api(openai_dto: OpenAiDTO, request: Request):
     """
     Endpoint to query OpenAI's API with a prompt and text.
     Parameters:
         openai_dto (OpenAiDTO): The OpenAI DTO containing the prompt, text, and temperature.
+            With stream set, the response is sent as it is generated, as server-sent
+            events or NDJSON per stream_format.
+    Returns:
+        dict | StreamingResponse: The AI's response.
+    """
+    if openai_dto.stream and openai_dto.stream_format not in ("sse", "ndjson"):
+        raise HTTPException(status_code=400, detail="stream_format must be sse or ndjson.")
+    tier, org = request_tier(request), request_org(request)
+    try:
+        if not openai_dto.stream:
+            return await call_openai_api(openai_dto.model, openai_dto.prompt, openai_dto.text, openai_dto.temperature,
+                                         openai_dto.max_tokens, cache=openai_dto.cache, tier=tier, org=org)
+        deltas = await stream_openai_api(openai_dto.model, openai_dto.prompt, openai_dto.text, openai_dto.temperature,
+                                         openai_dto.max_tokens, cache=openai_dto.cache, tier=tier, org=org)
+    except PromptTooLong as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except RateLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+    except (AdmissionRejected, CircuitOpen) as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+    except httpx.HTTPStatusError as e:
+        logger.error("Upstream error: %s", e)
+        if e.response.status_code == 429:
+            retry_after = retry_after_seconds(e.response)
+            raise HTTPException(status_code=429, detail="The AI provider is rate limiting requests. Try again later.",
+                                headers={"Retry-After": str(math.ceil(retry_after if retry_after is not None else 1))})
+        raise HTTPException(status_code=502, detail=f"The AI provider returned {e.response.status_code}.")
+    except httpx.TimeoutException as e:
+        logger.error("Upstream timeout: %r", e)
+        raise HTTPException(status_code=504, detail="The AI provider did not answer in time.")
+    except httpx.TransportError as e:
+        logger.error("Upstream unreachable: %r", e)
+        raise HTTPException(status_code=502, detail="The AI provider could not be reached.")
+    except MalformedResponse as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+    # Closes the upstream stream even if the client leaves before the body is sent
+    cleanup = BackgroundTask(deltas.aclose)
+    if openai_dto.stream_format == "ndjson":
+        return StreamingResponse(iter_ndjson(deltas), media_type="application/x-ndjson", background=cleanup)
+    # no-cache and X-Accel-Buffering keep proxies from holding back events
+    return StreamingResponse(iter_sse(deltas), media_type="text/event-stream", background=cleanup,
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/query_openai_api_batch")
+async def query_openai_api_batch(batch_dto: OpenAiBatchDTO, request: Request):
+    """
+    Endpoint to run many prompt and text items against OpenAI's API in one request.
+    Parameters:
+        batch_dto (OpenAiBatchDTO): The model, temperature and max tokens shared by the items,
+            the items, and how many of them to send upstream at once.
+    Returns:
+        StreamingResponse: NDJSON, one line per item as it completes, with its index, its id
+            if given, and its response or error, then {"done": true}.
+    """
+    if not batch_dto.items:
+        raise HTTPException(status_code=400, detail="items must not be empty.")
+    if len(batch_dto.items) > OPENAI_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"A batch takes at most {OPENAI_BATCH_MAX_ITEMS} items.")
+    concurrency = max(1, min(batch_dto.concurrency, OPENAI_BATCH_CONCURRENCY))
+    items = [(item.id, item.prompt, item.text) for item in batch_dto.items]
+    results = batch_openai_api(batch_dto.model, items, batch_dto.temperature, batch_dto.max_tokens,
+                               concurrency, cache=batch_dto.cache, tier=request_tier(request), org=request_org(request))
+    # Cancels the remaining items if the client leaves before the batch finishes
+    return StreamingResponse(iter_batch_ndjson(results), media_type="application/x-ndjson",
+                             background=BackgroundTask(results.aclose))
+
+
+@app.get("/openai_usage/{org}")
+def openai_usage_for_org(org: str, days: int = 30, user_org: str = Depends(login_org)):
+    """
+    Endpoint reporting an org's OpenAI token usage. Requires login to that organization.
+
+    Parameters:
+        org (str): The organization; must be the logged-in user's.
+        days (int): How many days back to report, today included.
+        user_org (str): The logged-in user's org (populated by the access token).
+
+    Returns:
+        dict: Per model and UTC day, the upstream calls and their prompt, completion
+            and total tokens. Each worker writes its counts every OPENAI_USAGE_FLUSH_SECONDS.
+    """
+    check_org(org, user_org)
+    since = datetime.now(timezone.utc).date() - timedelta(days=max(days, 1) - 1)
+    return {"org": org, "usage": usage_for_org(org, since)}
+
+
+@app.get("/openai_cache_stats")
+def openai_cache_stats():
+    """
+    Endpoint reporting the OpenAI response cache metrics of this worker.
+
+    Returns:
+        dict: Whether the cache is enabled, its hit, miss, store and eviction counts,
+            and the upstream calls started and requests coalesced into them.
+    """
+    flights = {"upstream_calls": openai_flights.metrics["calls"], "coalesced_requests": openai_flights.metrics["coalesced"]}
+    if response_cache is None:
+        return {"enabled": False, **flights}
+    return {"enabled": True, **response_cache.stats(), **flights}
+
+
+@app.get("/openai_admission_stats")
+def openai_admission_stats():
+    """
+    Endpoint reporting the upstream call queue and circuit breakers of this worker.
+
     Returns:
-        dict: The AI's response.
+        dict: Calls in flight and queued, per tier the calls admitted, rejected
+            and timed out, with their mean, max and histogram of queue times in seconds,
+            and per model the circuit state ("closed", "open" or "half_open").
     """
-    return await call_openai_api(openai_dto.model, openai_dto.prompt, openai_dto.text, openai_dto.temperature, openai_dto.max_tokens)
+    stats = openai_admission.stats()
+    stats["circuits"] = {model: breaker.state for model, breaker in openai_breakers.items()}
+    return stats
@@ -0,0 +1,11 @@
+CREATE TABLE bulk_imports (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    kind VARCHAR(20) NOT NULL, -- users or addresses
+    org VARCHAR(100) NOT NULL DEFAULT '', -- empty when the upload is not scoped to one org
+    content_hash CHAR(64) NOT NULL, -- sha256 of the uploaded file
+    status VARCHAR(20) NOT NULL, -- running, completed or failed
+    result TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    CONSTRAINT unique_bulk_import UNIQUE (kind, org, content_hash)
+);
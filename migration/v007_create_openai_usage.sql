@@ -0,0 +1,12 @@
+CREATE TABLE openai_usage (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    org VARCHAR(100) NOT NULL DEFAULT '', -- empty for calls without a logged-in org
+    model VARCHAR(100) NOT NULL,
+    day DATE NOT NULL, -- UTC
+    requests INT NOT NULL DEFAULT 0, -- upstream calls
+    prompt_tokens BIGINT NOT NULL DEFAULT 0,
+    completion_tokens BIGINT NOT NULL DEFAULT 0,
+    total_tokens BIGINT NOT NULL DEFAULT 0,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    CONSTRAINT unique_openai_usage UNIQUE (org, model, day)
+);
@@ -0,0 +1,176 @@
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger('admission')
+
+# Highest priority first
+TIERS = ("premium", "regular", "anonymous")
+
+# Upper bounds, in seconds, of the queue time histogram buckets
+QUEUE_TIME_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, float("inf"))
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a call cannot get a slot: the queue is full, or the wait timed out.
+    """
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _TierMetrics:
+    def __init__(self):
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.queue_time_total = 0.0
+        self.queue_time_max = 0.0
+        self.queue_time_buckets = [0] * len(QUEUE_TIME_BUCKETS)
+
+    def observe(self, seconds: float):
+        self.admitted += 1
+        self.queue_time_total += seconds
+        self.queue_time_max = max(self.queue_time_max, seconds)
+        for i, bound in enumerate(QUEUE_TIME_BUCKETS):
+            if seconds <= bound:
+                self.queue_time_buckets[i] += 1
+                break
+
+    def as_dict(self):
+        return {
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "queue_time_mean": round(self.queue_time_total / self.admitted, 4) if self.admitted else 0.0,
+            "queue_time_max": round(self.queue_time_max, 4),
+            "queue_time_buckets": {
+                ("+Inf" if bound == float("inf") else f"{bound:g}"): count
+                for bound, count in zip(QUEUE_TIME_BUCKETS, self.queue_time_buckets)
+            },
+        }
+
+
+class AdmissionController:
+    """
+    Limits how many upstream calls run at once. Calls over the limit wait in
+    a bounded queue, ordered by tier (premium, regular, anonymous) and then
+    by arrival, and each freed slot goes to the first waiter.
+
+    When the queue is full, a call that outranks the lowest-priority waiter
+    takes its place and that waiter is rejected; otherwise the new call is
+    rejected. A waiter is also rejected after max_wait seconds.
+
+    Parameters:
+        max_in_flight (int): Calls allowed to run at once.
+        max_queued (int): Calls allowed to wait for a slot.
+        max_wait (float): Seconds a call may wait for a slot.
+    """
+
+    def __init__(self, max_in_flight: int, max_queued: int, max_wait: float):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self._queue = []  # heap of [priority, seq, future, tier]
+        self._queued = 0
+        self._seq = itertools.count()
+        self._metrics = {tier: _TierMetrics() for tier in TIERS}
+
+    def _reject(self, tier: str, reason: str):
+        self._metrics[tier].rejected += 1
+        logger.warning("Rejected %s upstream call: %s.", tier, reason)
+        return AdmissionRejected(f"Too many AI requests in progress ({reason}). Try again later.", self.max_wait)
+
+    def _evict_lowest(self, priority: int):
+        # Rejects the newest waiter of the lowest tier below priority; returns whether one was found
+        lowest = None
+        for entry in self._queue:
+            if not entry[2].done() and entry[0] > priority and (lowest is None or entry[:2] > lowest[:2]):
+                lowest = entry
+        if lowest is None:
+            return False
+        lowest[2].set_exception(self._reject(lowest[3], "displaced by a higher tier"))
+        self._queued -= 1
+        return True
+
+    async def acquire(self, tier: str = "regular"):
+        """
+        Waits for a slot. Every successful acquire must be paired with release().
+
+        Raises:
+            AdmissionRejected: The queue is full or max_wait passed.
+        """
+        tier = tier if tier in self._metrics else "regular"
+        if self.in_flight < self.max_in_flight and not self._queued:
+            self.in_flight += 1
+            self._metrics[tier].observe(0.0)
+            return
+
+        priority = TIERS.index(tier)
+        if self._queued >= self.max_queued and not self._evict_lowest(priority):
+            raise self._reject(tier, "queue full")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, [priority, next(self._seq), future, tier])
+        self._queued += 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.cancel()
+                self._queued -= 1
+                self._metrics[tier].timed_out += 1
+                raise AdmissionRejected("Timed out waiting for an AI request slot. Try again later.", self.max_wait)
+            # The slot arrived just as the wait timed out
+            if future.exception():
+                raise future.exception()
+        except asyncio.CancelledError:
+            if not future.done():
+                future.cancel()
+                self._queued -= 1
+            elif not future.cancelled() and future.exception() is None:
+                # Granted a slot, but the caller went away
+                self.release()
+            raise
+        self._metrics[tier].observe(time.monotonic() - started)
+
+    def release(self):
+        """
+        Frees a slot, handing it to the first waiter if there is one.
+        """
+        while self._queue:
+            _, _, future, _ = heapq.heappop(self._queue)
+            if not future.done():
+                self._queued -= 1
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    @asynccontextmanager
+    async def slot(self, tier: str = "regular"):
+        await self.acquire(tier)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Calls in flight and queued, the limits, and per tier the calls
+                admitted, rejected and timed out with their queue times in seconds.
+        """
+        return {
+            "in_flight": self.in_flight,
+            "queued": self._queued,
+            "max_in_flight": self.max_in_flight,
+            "max_queued": self.max_queued,
+            "tiers": {tier: metrics.as_dict() for tier, metrics in self._metrics.items()},
+        }
@@ -0,0 +1,83 @@
+import os
+import logging
+from dotenv import load_dotenv
+from fastapi import Depends, HTTPException, Request
+from fastapi_login import LoginManager
+from starlette.concurrency import run_in_threadpool
+from db.manage_user import return_user_by_email
+from utils.limiter import by_token_claim
+
+logger = logging.getLogger('px')
+
+load_dotenv()
+
+# Secret key for session management
+LOGIN_SECRET = os.getenv("LOGIN_SECRET")
+if not LOGIN_SECRET:
+    raise RuntimeError("LOGIN_SECRET environment variable is not set. Please define it in your .env file.")
+
+
+class OrgLoginManager(LoginManager):
+    """
+    LoginManager whose user loader is called with the token's org as well as its
+    subject, since a user is identified by their email and org together.
+    """
+
+    async def _get_current_user(self, payload: dict):
+        email, org = payload.get("sub"), payload.get("org")
+        if email is None or org is None:
+            raise self.not_authenticated_exception
+        user = await run_in_threadpool(self._user_callback, email, org)
+        if user is None:
+            raise self.not_authenticated_exception
+        return user
+
+
+manager = OrgLoginManager(LOGIN_SECRET, token_url="/login")
+
+token_org = by_token_claim(LOGIN_SECRET, "org")
+
+
+@manager.user_loader()
+def load_user(email: str, org: str):
+    """
+    Load user from the database using their email and org.
+
+    Parameters:
+        email (str): The email of the user.
+        org (str): The organization of the user.
+
+    Returns:
+        dict or None: The user object if found, otherwise None.
+    """
+    logger.debug("Attempting to load user with email: %s for %s", email, org)
+
+    user = return_user_by_email(email, org)
+    if user:
+        logger.debug("User found: %s in %s", user.email, org)
+        return user.email
+    logger.warning("No user found for %s", org)
+    return None
+
+
+def request_org(request: Request):
+    """
+    The org of the logged-in user making a request, or "" without a valid bearer token.
+    """
+    return token_org({"request": request}) or ""
+
+
+def login_org(request: Request, user=Depends(manager)):
+    """
+    Dependency requiring a login, returning the logged-in user's org.
+    """
+    return request_org(request)
+
+
+def check_org(org: str, user_org: str):
+    """
+    Raises a 403 unless org is the logged-in user's org.
+    """
+    if org != user_org:
+        logger.warning("Refused access to %s for a user of %s", org, user_org)
+        raise HTTPException(status_code=403, detail="Not allowed to access another organization.")
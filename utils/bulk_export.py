@@ -0,0 +1,166 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+import csv
+import io
+import json
+import os
+import re
+from urllib.parse import quote
+from db.manage_user import iter_users_by_org, EXPORT_USER_COLUMNS, EXPORT_ADDRESS_COLUMNS
+from utils.auth import check_org, login_org
+import logging
+
+logger = logging.getLogger('bulk_export')
+
+router = APIRouter()
+
+# Number of rows fetched from the database and written to the response at a time
+EXPORT_BATCH_SIZE = int(os.getenv("BULK_EXPORT_BATCH_SIZE", "1000"))
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet"
+}
+
+
+def _content_disposition(filename: str):
+    """
+    Returns:
+        str: An attachment Content-Disposition for a filename that may hold quotes,
+            semicolons or non-ASCII characters: a plain ASCII fallback for old
+            clients, and the exact name percent-encoded per RFC 6266.
+    """
+    fallback = re.sub(r'[^A-Za-z0-9._-]', "_", filename)
+    return f'attachment; filename="{fallback}"; filename*=UTF-8\'\'{quote(filename, safe="")}'
+
+
+def _iter_csv(batches, columns: list[str]):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns)
+    writer.writeheader()
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Always send at least the header
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _iter_ndjson(batches, include_addresses: bool):
+    """
+    Writes one JSON object per user. With addresses, the joined rows of a user
+    are folded into an "addresses" list; a user's rows may span two batches,
+    so the last user of each batch is held back until the next one.
+    """
+    user = None
+    for rows in batches:
+        lines = []
+        for row in rows:
+            if not include_addresses:
+                lines.append(json.dumps(row, default=str))
+                continue
+            if user is None or user["id"] != row["id"]:
+                if user is not None:
+                    lines.append(json.dumps(user, default=str))
+                user = {column: row[column] for column in EXPORT_USER_COLUMNS}
+                user["addresses"] = []
+            if row["address_id"] is not None:
+                user["addresses"].append({
+                    "id": row["address_id"],
+                    **{column: row[column] for column in EXPORT_ADDRESS_COLUMNS[1:]}
+                })
+        if lines:
+            yield "\n".join(lines) + "\n"
+    if user is not None:
+        yield json.dumps(user, default=str) + "\n"
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that collects whatever the Parquet writer flushes until it is drained."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _iter_parquet(batches, columns: list[str]):
+    """
+    Writes every batch as its own Parquet row group and sends it as soon as it is written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        (column, pa.timestamp("us") if column in ("created_at", "updated_at")
+         else pa.int64() if column in ("id", "address_id") else pa.string())
+        for column in columns
+    ])
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for rows in batches:
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+@router.get("/export_users/{org}")
+def export_users(
+    org: str,
+    format: str = Query("csv", pattern="^(csv|ndjson|parquet)$"),
+    include_addresses: bool = Query(False),
+    user_org: str = Depends(login_org)
+):
+    """
+    Endpoint to export all users of an organization. Requires login to that organization.
+    Rows are read with a server-side cursor and streamed as they are fetched.
+
+    Parameters:
+        org (str): The organization to export; must be the logged-in user's.
+        format (str): "csv" (default), "ndjson" or "parquet" (requires pyarrow).
+        include_addresses (bool): Include each user's addresses. CSV and Parquet
+            get one row per address; NDJSON nests them in an "addresses" list.
+        user_org (str): The logged-in user's org (populated by the access token).
+
+    Returns:
+        StreamingResponse: The exported users.
+    """
+    check_org(org, user_org)
+    columns = EXPORT_USER_COLUMNS + (EXPORT_ADDRESS_COLUMNS if include_addresses else [])
+    batches = iter_users_by_org(org, include_addresses, EXPORT_BATCH_SIZE)
+
+    if format == "csv":
+        body = _iter_csv(batches, columns)
+    elif format == "ndjson":
+        body = _iter_ndjson(batches, include_addresses)
+    else:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=501, detail="Parquet export requires the pyarrow package.")
+        body = _iter_parquet(batches, columns)
+
+    logger.info("Exporting users for %s as %s", org, format)
+    return StreamingResponse(
+        body,
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": _content_disposition(f"{org}_users.{format}")}
+    )
@@ -0,0 +1,159 @@
+import csv
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+import uuid
+
+# Directory where per-row failure reports of bulk uploads are written
+REPORT_DIR = os.getenv("BULK_REPORT_DIR", os.path.join(tempfile.gettempdir(), "px_bulk_reports"))
+# Seconds a report can be downloaded after its upload finished; older reports are deleted
+REPORT_TTL_SECONDS = int(os.getenv("BULK_REPORT_TTL_SECONDS", str(7 * 24 * 3600)))
+
+logger = logging.getLogger('bulk_report')
+
+REPORT_FIELDS = ["row", "email", "org", "reason"]
+
+_REPORT_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class BulkReport:
+    """
+    Collects the outcome of a bulk upload.
+
+    Only counters are kept in memory; every failed row is appended to an
+    NDJSON file on disk as soon as it is recorded, so the size of the
+    response does not grow with the size of the upload.
+    """
+
+    def __init__(self):
+        os.makedirs(REPORT_DIR, exist_ok=True)
+        purge_expired_reports()
+        self.report_id = uuid.uuid4().hex
+        self.created = 0
+        self.failed = 0
+        self.started = time.perf_counter()
+        self._file = open(report_path(self.report_id), "w", encoding="utf-8")
+
+    def add_created(self, count: int = 1):
+        self.created += count
+
+    def add_failure(self, row: int, email: str, org: str, reason: str):
+        self.failed += 1
+        self._file.write(json.dumps({"row": row, "email": email, "org": org, "reason": reason}) + "\n")
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def summary(self, message: str = "Bulk upload completed."):
+        """
+        Returns the compact result of the upload: counts, timing and where
+        to download the failure report.
+        """
+        elapsed = time.perf_counter() - self.started
+        total = self.created + self.failed
+        return {
+            "message": message,
+            "report_id": self.report_id,
+            "total_rows": total,
+            "created": self.created,
+            "failed": self.failed,
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(total / elapsed, 1) if elapsed > 0 else None,
+            "report_url": f"/bulk_upload_reports/{self.report_id}"
+        }
+
+
+def report_path(report_id: str):
+    """
+    Returns the path of a report file, or None if the id is malformed.
+    """
+    if not _REPORT_ID.match(report_id):
+        return None
+    return os.path.join(REPORT_DIR, f"{report_id}.ndjson")
+
+
+def _expired(path: str, now: float):
+    return os.path.getmtime(path) < now - REPORT_TTL_SECONDS
+
+
+def purge_expired_reports():
+    """
+    Deletes the reports older than REPORT_TTL_SECONDS.
+
+    Returns:
+        int: The number of reports deleted.
+    """
+    now = time.time()
+    deleted = 0
+    for entry in os.scandir(REPORT_DIR):
+        name, _, extension = entry.name.partition(".")
+        if extension != "ndjson" or not _REPORT_ID.match(name):
+            continue
+        try:
+            if _expired(entry.path, now):
+                os.remove(entry.path)
+                deleted += 1
+        except FileNotFoundError:
+            pass  # deleted by another worker
+    if deleted:
+        logger.info("Deleted %s expired bulk upload reports.", deleted)
+    return deleted
+
+
+def find_report(report_id: str):
+    """
+    Returns the path of a report that can still be downloaded, or None if the
+    id is malformed or the report does not exist or has expired (it is then deleted).
+    """
+    path = report_path(report_id)
+    if path is None:
+        return None
+    try:
+        if not _expired(path, time.time()):
+            return path
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def iter_report(path: str, fmt: str = "ndjson", chunk_size: int = 1000):
+    """
+    Streams a report file as NDJSON or CSV without loading it into memory.
+
+    Parameters:
+        path (str): The report file path.
+        fmt (str): "ndjson" or "csv".
+        chunk_size (int): Number of rows per yielded chunk.
+
+    Yields:
+        str: The next piece of the report.
+    """
+    with open(path, encoding="utf-8") as report:
+        if fmt == "ndjson":
+            while True:
+                lines = report.readlines(chunk_size * 128)
+                if not lines:
+                    return
+                yield "".join(lines)
+
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        for count, line in enumerate(report, start=1):
+            writer.writerow(json.loads(line))
+            if count % chunk_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
@@ -1,67 +1,403 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Query
+from fastapi.responses import StreamingResponse
 import pandas as pd
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
 from dtos.user_dto import UserDTO
-from db.manage_user import add_user
+from db.manage_user import add_user, add_user_addresses_bulk
+from db.bulk_load import UserBulkLoader
+from db.session_objects import Address, User
+from db.bulk_imports import claim_bulk_import, finish_bulk_import, heartbeat_bulk_import
+from utils.auth import check_org, login_org
+from utils.bulk_report import REPORT_TTL_SECONDS, BulkReport, find_report, iter_report
 import logging
 
 logger = logging.getLogger('bulk_upload')
 
 router = APIRouter()
 
+# Number of rows read from the upload and written to the database at a time
+CHUNK_SIZE = int(os.getenv("BULK_UPLOAD_CHUNK_SIZE", "1000"))
+
+USER_COLUMNS = ["first_name", "last_name", "email", "password", "org"]
+ADDRESS_COLUMNS = ["email", "org", "street", "city", "state", "zip_code", "country"]
+REQUIRED_ADDRESS_FIELDS = ["email", "org", "street", "city", "country"]
+
+
+def _max_lengths(*models):
+    # Longest value each String column holds; longer values would be truncated or fail the whole chunk
+    return {
+        column.name: column.type.length
+        for model in models for column in model.__table__.columns
+        if getattr(column.type, "length", None)
+    }
+
+
+USER_LENGTHS = _max_lengths(User)
+ADDRESS_LENGTHS = {**_max_lengths(Address), "email": USER_LENGTHS["email"], "org": USER_LENGTHS["org"]}
+
+# Seconds a repeated upload waits for the identical upload running in this worker
+IMPORT_WAIT_SECONDS = int(os.getenv("BULK_IMPORT_WAIT_SECONDS", "300"))
+# Seconds without a heartbeat after which a running import is assumed to have died and may be run again
+IMPORT_STALE_SECONDS = int(os.getenv("BULK_IMPORT_STALE_SECONDS", "600"))
+# A running import refreshes its claim at most this often, between chunks and while merging
+IMPORT_HEARTBEAT_SECONDS = int(os.getenv("BULK_IMPORT_HEARTBEAT_SECONDS", "60"))
+# Seconds after an import completed during which the same upload returns its result instead of
+# running again; at most BULK_REPORT_TTL_SECONDS, so the returned report can still be downloaded
+IMPORT_REPLAY_SECONDS = min(int(os.getenv("BULK_IMPORT_REPLAY_SECONDS", str(REPORT_TTL_SECONDS))), REPORT_TTL_SECONDS)
+
+# (kind, org, content hash) -> Event set when the import running in this worker finishes
+_running_imports = {}
+_running_imports_lock = threading.Lock()
+
+
+def _check_format(file: UploadFile):
+    if not file.filename.endswith((".csv", ".ndjson", ".jsonl")):
+        raise HTTPException(status_code=400, detail="Invalid file format. Please upload a CSV or NDJSON file.")
+
+
+def _iter_chunks(file: UploadFile, columns: list[str], required_columns: list[str], report: BulkReport, heartbeat=None):
+    """
+    Stream rows from an uploaded CSV or NDJSON file in chunks of CHUNK_SIZE.
+
+    Each row is a dict of string values with a 1-based "row" number added, so
+    failures can be reported against the line in the original file. Optional
+    columns missing from the file or a row are set to "".
+
+    Parameters:
+        file (UploadFile): The uploaded file.
+        columns (list[str]): Columns of every row.
+        required_columns (list[str]): Columns the file or row must provide. A CSV
+            without them is rejected before any row is imported; an NDJSON line
+            without them, or that is not a JSON object, is reported as failed.
+        report (BulkReport): Where NDJSON lines that cannot be read are reported.
+        heartbeat (callable, optional): Called after each chunk is processed.
+
+    Yields:
+        list[dict]: The next chunk of rows.
+    """
+    for chunk in _read_chunks(file, columns, required_columns, report):
+        yield chunk
+        if heartbeat:
+            heartbeat()
+
+
+def _read_chunks(file: UploadFile, columns: list[str], required_columns: list[str], report: BulkReport):
+    row_number = 0
+    if file.filename.endswith(".csv"):
+        reader = pd.read_csv(file.file, chunksize=CHUNK_SIZE, dtype=str, keep_default_na=False)
+        for df in reader:
+            if not all(column in df.columns for column in required_columns):
+                raise HTTPException(status_code=400, detail=f"CSV file must contain the following columns: {', '.join(required_columns)}")
+            rows = df.to_dict("records")
+            for row in rows:
+                row_number += 1
+                for column in columns:
+                    row.setdefault(column, "")
+                row["row"] = row_number
+            yield rows
+        return
+
+    chunk = []
+    for line in io.TextIOWrapper(file.file, encoding="utf-8"):
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError:
+            report.add_failure(row_number, "", "", "Invalid JSON")
+            continue
+        if not isinstance(row, dict):
+            report.add_failure(row_number, "", "", "Row is not a JSON object")
+            continue
+        missing = [column for column in required_columns if column not in row]
+        if missing:
+            report.add_failure(row_number, str(row.get("email") or ""), str(row.get("org") or ""),
+                               f"Missing {', '.join(missing)}")
+            continue
+        row = {key: "" if value is None else str(value) for key, value in row.items()}
+        for column in columns:
+            row.setdefault(column, "")
+        row["row"] = row_number
+        chunk.append(row)
+        if len(chunk) >= CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _hash_upload(file: UploadFile):
+    digest = hashlib.sha256()
+    for block in iter(lambda: file.file.read(1 << 20), b""):
+        digest.update(block)
+    file.file.seek(0)
+    return digest.hexdigest()
+
+
+class _Heartbeat:
+    """
+    Keeps a running import's claim fresh, writing at most every IMPORT_HEARTBEAT_SECONDS.
+    Raises a 409 once the claim is lost, so the import stops instead of running
+    alongside the request that took it over.
+    """
+
+    def __init__(self, import_id: int, claimed_at):
+        self.import_id = import_id
+        self.claimed_at = claimed_at
+        self.lost = False
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _beat(self):
+        with self._lock:
+            if not self.lost:
+                claimed_at = heartbeat_bulk_import(self.import_id, self.claimed_at)
+                if claimed_at is None:
+                    logger.error("Lost the claim on bulk import %s; stopping it.", self.import_id)
+                    self.lost = True
+                else:
+                    self.claimed_at = claimed_at
+                    self._last = time.monotonic()
+            return not self.lost
+
+    def _check(self):
+        if self.lost:
+            raise HTTPException(status_code=409, detail="The upload was taken over by another request.")
+
+    def __call__(self):
+        if time.monotonic() - self._last >= IMPORT_HEARTBEAT_SECONDS:
+            self._beat()
+        self._check()
+
+    @contextmanager
+    def during(self):
+        """
+        Beats from a background thread while a long statement runs, e.g. the merge
+        of a fast path upload, which cannot call back between chunks.
+        """
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(IMPORT_HEARTBEAT_SECONDS) and self._beat():
+                pass
+
+        thread = threading.Thread(target=beat, name=f"bulk-import-{self.import_id}", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+        self._check()
+
+
+def _run_once(kind: str, org: str, file: UploadFile, run):
+    """
+    Runs a bulk import at most once per (kind, org, file content).
+
+    The upload is hashed first. A retry of an import that completed within
+    IMPORT_REPLAY_SECONDS gets the original summary back; a retry of an import that is still
+    running in this worker waits for it, and one running elsewhere gets a 409.
+
+    Parameters:
+        kind (str): "users" or "addresses".
+        org (str): The org the upload is scoped to, or None.
+        file (UploadFile): The uploaded file.
+        run (callable): Runs the import and returns its summary; called with a heartbeat
+            to call between chunks, which keeps the claim from going stale.
+
+    Returns:
+        dict: The import summary, with "replayed" set when it was not run again.
+    """
+    org = org or ""
+    key = (kind, org, _hash_upload(file))
+    with _running_imports_lock:
+        done = _running_imports.get(key)
+        leader = done is None
+        if leader:
+            done = _running_imports[key] = threading.Event()
+
+    try:
+        if not leader and not done.wait(IMPORT_WAIT_SECONDS):
+            raise HTTPException(status_code=409, detail="An identical upload is still being processed.", headers={"Retry-After": "30"})
+
+        status, import_id, result = claim_bulk_import(kind, org, key[2], IMPORT_STALE_SECONDS, IMPORT_REPLAY_SECONDS)
+        if status == "completed":
+            logger.info("Returning the result of %s import %s for a repeated upload.", kind, import_id)
+            return {**result, "replayed": True}
+        if status == "running":
+            raise HTTPException(status_code=409, detail="An identical upload is still being processed.", headers={"Retry-After": "30"})
+
+        heartbeat = _Heartbeat(import_id, result)
+        result = None
+        try:
+            result = run(heartbeat)
+            return result
+        finally:
+            finish_bulk_import(import_id, heartbeat.claimed_at, result)
+    finally:
+        if leader:
+            with _running_imports_lock:
+                del _running_imports[key]
+            done.set()
+
+
+def _valid_rows(rows: list[dict], required: list[str], org: str, report: BulkReport, max_lengths: dict):
+    """
+    Reports rows with missing required fields, values too long for their column
+    or outside the upload's org, and returns the rest.
+    """
+    valid = []
+    for row in rows:
+        missing = [field for field in required if not row[field]]
+        too_long = [column for column, length in max_lengths.items() if len(row.get(column, "")) > length]
+        if missing:
+            report.add_failure(row["row"], row["email"], row["org"], f"Missing {', '.join(missing)}")
+        elif too_long:
+            report.add_failure(row["row"], row["email"], row["org"],
+                               "Too long: " + ", ".join(f"{column} (max {max_lengths[column]})" for column in too_long))
+        elif org and row["org"] != org:
+            report.add_failure(row["row"], row["email"], row["org"], f"Row is not in org {org}")
+        else:
+            valid.append(row)
+    return valid
+
+
 @router.post("/bulk_upload_users")
-def bulk_upload_users(file: UploadFile = File(...)):
+def bulk_upload_users(file: UploadFile = File(...), fast_path: bool = Query(False), org: str = Query(None)):
     """
-    Endpoint to bulk upload users from a CSV file.
+    Endpoint to bulk upload users from a CSV or NDJSON file.
+    Uploading the same file again returns the result of the first upload.
 
     Parameters:
-        file (UploadFile): The uploaded CSV file containing user data.
+        file (UploadFile): The uploaded file containing user data.
+        fast_path (bool): Stage all rows and merge them into users with one statement
+            (LOAD DATA LOCAL INFILE on MySQL) instead of inserting them one by one.
+        org (str, optional): Restrict the upload to one organization; rows for other orgs fail.
 
     Returns:
         dict: A summary of the bulk upload process.
     """
-    if not file.filename.endswith(".csv"):
-        raise HTTPException(status_code=400, detail="Invalid file format. Please upload a CSV file.")
+    _check_format(file)
 
     try:
-        # Read the CSV file into a pandas DataFrame
-        df = pd.read_csv(file.file)
-
-        # Validate required columns
-        required_columns = ["first_name", "last_name", "email", "password", "org"]
-        if not all(column in df.columns for column in required_columns):
-            raise HTTPException(status_code=400, detail=f"CSV file must contain the following columns: {', '.join(required_columns)}")
-
-        # Iterate through the rows and create users
-        created_users = []
-        failed_users = []
-        for _, row in df.iterrows():
-            try:
-                # Create a UserDTO object
-                user_dto = UserDTO(
-                    first_name=row["first_name"],
-                    last_name=row["last_name"],
-                    email=row["email"],
-                    org=row["org"],
-                    password=row["password"]
-                )
-
-
-                # Add the user to the database
-                new_user = add_user(user_dto)
-                if new_user:
-                    created_users.append(row["email"])
-                else:
-                    failed_users.append(row["email"])
-            except Exception as e:
-                logger.error(f"Failed to create user {row['email']}: {e}")
-                failed_users.append(row["email"])
+        run = _bulk_load_users if fast_path else _add_users
+        return _run_once("users", org, file, lambda heartbeat: run(file, org, heartbeat))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error processing bulk upload: %s", e)
+        raise HTTPException(status_code=500, detail="An error occurred while processing the file.")
+
+
+def _add_users(file: UploadFile, org: str, heartbeat=None):
+    with BulkReport() as report:
+        for rows in _iter_chunks(file, USER_COLUMNS, USER_COLUMNS, report, heartbeat):
+            for row in _valid_rows(rows, USER_COLUMNS, org, report, USER_LENGTHS):
+                try:
+                    # Create a UserDTO object
+                    user_dto = UserDTO(
+                        first_name=row["first_name"],
+                        last_name=row["last_name"],
+                        email=row["email"],
+                        org=row["org"],
+                        password=row["password"]
+                    )
+
+                    # Add the user to the database
+                    if add_user(user_dto):
+                        report.add_created()
+                    else:
+                        report.add_failure(row["row"], row["email"], row["org"], "Failed to create user")
+                except Exception as e:
+                    logger.error("Failed to create user %s: %s", row['email'], e)
+                    report.add_failure(row["row"], row["email"], row["org"], str(e))
+
+    return report.summary()
+
+
+def _bulk_load_users(file: UploadFile, org: str, heartbeat=None):
+    with BulkReport() as report, UserBulkLoader() as loader:
+        for rows in _iter_chunks(file, USER_COLUMNS, USER_COLUMNS, report, heartbeat):
+            valid_rows = _valid_rows(rows, USER_COLUMNS, org, report, USER_LENGTHS)
+            if valid_rows:
+                loader.stage(valid_rows)
+
+        # One long statement on MySQL, so the claim is kept fresh from a thread meanwhile
+        with heartbeat.during() if heartbeat else nullcontext():
+            report.add_created(loader.merge(report.add_failure))
+
+    return report.summary()
 
-        return {
-            "message": "Bulk upload completed.",
-            "created_users": created_users,
-            "failed_users": failed_users
-        }
 
+@router.post("/bulk_upload_addresses")
+def bulk_upload_addresses(file: UploadFile = File(...), org: str = Query(None), user_org: str = Depends(login_org)):
+    """
+    Endpoint to bulk upload addresses from a CSV or NDJSON file. Requires login.
+    Each row is matched to an existing user by its email and org.
+    Uploading the same file again returns the result of the first upload.
+
+    Parameters:
+        file (UploadFile): The uploaded file containing address data.
+        org (str, optional): The organization of the upload; must be the logged-in
+            user's, which is also the default. Rows for other orgs fail.
+        user_org (str): The logged-in user's org (populated by the access token).
+
+    Returns:
+        dict: A summary of the bulk upload process.
+    """
+    check_org(org or user_org, user_org)
+    org = user_org
+    _check_format(file)
+
+    try:
+        return _run_once("addresses", org, file, lambda heartbeat: _add_addresses(file, org, heartbeat))
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error processing bulk upload: {e}")
-        raise HTTPException(status_code=500, detail="An error occurred while processing the file.")
\ No newline at end of file
+        logger.error("Error processing bulk address upload: %s", e)
+        raise HTTPException(status_code=500, detail="An error occurred while processing the file.")
+
+
+def _add_addresses(file: UploadFile, org: str, heartbeat=None):
+    with BulkReport() as report:
+        for rows in _iter_chunks(file, ADDRESS_COLUMNS, REQUIRED_ADDRESS_FIELDS, report, heartbeat):
+            valid_rows = _valid_rows(rows, REQUIRED_ADDRESS_FIELDS, org, report, ADDRESS_LENGTHS)
+            if valid_rows:
+                added, failed_rows = add_user_addresses_bulk(valid_rows)
+                report.add_created(added)
+                for failed in failed_rows:
+                    report.add_failure(failed["row"], failed["email"], failed["org"], failed["reason"])
+
+    return report.summary()
+
+
+@router.get("/bulk_upload_reports/{report_id}")
+def download_bulk_upload_report(report_id: str, format: str = Query("ndjson", pattern="^(ndjson|csv)$")):
+    """
+    Endpoint to download the per-row failure report of a bulk upload.
+
+    Parameters:
+        report_id (str): The report_id returned by the bulk upload.
+        format (str): "ndjson" (default) or "csv".
+
+    Returns:
+        StreamingResponse: The failed rows with the reason each one failed.
+    """
+    path = find_report(report_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="Report not found or expired.")
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        iter_report(path, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{report_id}.{format}"'}
+    )
@@ -0,0 +1,69 @@
+import time
+import logging
+
+logger = logging.getLogger('circuit_breaker')
+
+
+class CircuitOpen(Exception):
+    """
+    Raised instead of calling an upstream that is failing.
+    """
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Stops calls to an upstream after failure_threshold consecutive failures.
+
+    While open, check() raises CircuitOpen. Once reset_timeout has passed,
+    one trial call is let through: a success closes the circuit, a failure
+    keeps it open for another reset_timeout. If the trial ends with neither,
+    the next one is let through after another reset_timeout.
+
+    Parameters:
+        name (str): Upstream name, used in messages.
+        failure_threshold (int): Consecutive failures that open the circuit.
+        reset_timeout (float): Seconds the circuit stays open before a trial call.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "open" if time.monotonic() < self.opened_at + self.reset_timeout else "half_open"
+
+    def check(self):
+        """
+        Raises:
+            CircuitOpen: The circuit is open and this is not the trial call.
+        """
+        if self.opened_at is None:
+            return
+        remaining = self.opened_at + self.reset_timeout - time.monotonic()
+        if remaining > 0:
+            raise CircuitOpen(f"{self.name} is unavailable. Try again later.", remaining)
+        # This call is the trial; the rest fail fast until it succeeds or another period passes
+        self.opened_at = time.monotonic()
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info("Circuit for %s closed.", self.name)
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning("Circuit for %s opened after %s consecutive failures.", self.name, self.failures)
+            self.opened_at = time.monotonic()
@@ -1,42 +1,452 @@
+import os
 import time
+import asyncio
+import inspect
 import logging
+import threading
+from collections import OrderedDict
 from functools import wraps
+from typing import Callable, NamedTuple
+import jwt
+from starlette.requests import Request
 
 logger = logging.getLogger('limiter')
 
-rate_limit_store = {}
 
-def rate_limiter(max_requests: int, time_window: int):
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    remaining: int  # requests still allowed right now
+    retry_after: float  # seconds until the next request is allowed, 0 when allowed
+    reset_after: float  # seconds until the full quota is available again
+
+
+class RateLimitBackend:
+    """
+    Where rate limit state is kept. Implementations must make check atomic
+    for every process that shares the backend; see utils/limiter_backends.py
+    for the host-shared memory and Redis implementations.
+    """
+
+    def check(self, key: str, max_requests: int, time_window: float):
+        """
+        Records a request for key if it is within the quota.
+
+        Returns:
+            RateLimitResult: Whether the request is allowed and the quota state.
+        """
+        raise NotImplementedError
+
+    async def acheck(self, key: str, max_requests: int, time_window: float):
+        """
+        Same as check, for use on the event loop. Backends that do network
+        I/O override this so they don't block the loop.
+        """
+        return self.check(key, max_requests, time_window)
+
+    async def aclose(self):
+        """
+        Releases what acheck opened on the running loop. Called from the app lifespan.
+        """
+
+
+class _Stripe:
+    __slots__ = ("lock", "tats", "next_sweep")
+
+    def __init__(self, next_sweep: float):
+        self.lock = threading.Lock()
+        self.tats = OrderedDict()
+        self.next_sweep = next_sweep
+
+
+class RateLimitStore(RateLimitBackend):
+    """
+    In-process rate limit state using GCRA (the generic cell rate algorithm).
+
+    Each key keeps a single float, its theoretical arrival time (TAT), so a
+    check is O(1) in time and memory regardless of the quota. A key whose TAT
+    is in the past has its full quota again and carries no information, so
+    it can be dropped: idle keys are swept on a timer and the least recently
+    used keys are evicted once max_keys is reached.
+
+    Sync endpoints call the store from many threadpool threads at once, so
+    the keys are split by hash across independently locked stripes. Checks
+    for the same key are serialized; checks for different keys rarely wait
+    on each other.
+
+    Parameters:
+        max_keys (int): Maximum number of keys kept in memory.
+        sweep_interval (float): Seconds between sweeps of idle keys.
+        stripes (int): Number of independently locked partitions.
+    """
+
+    def __init__(self, max_keys: int = 100_000, sweep_interval: float = 60.0, stripes: int = 16):
+        self.max_keys = max_keys
+        self.sweep_interval = sweep_interval
+        self._max_stripe_keys = max(1, max_keys // stripes)
+        next_sweep = time.monotonic() + sweep_interval
+        self._stripes = [_Stripe(next_sweep) for _ in range(stripes)]
+
+    def __len__(self):
+        return sum(len(stripe.tats) for stripe in self._stripes)
+
+    def check(self, key, max_requests: int, time_window: float, now: float = None):
+        """
+        Records a request for key if it is within the quota.
+
+        Parameters:
+            key: The identity being limited.
+            max_requests (int): Maximum allowed requests within the time window.
+            time_window (float): Time window in seconds.
+            now (float, optional): Current monotonic time, mainly for tests and benchmarks.
+
+        Returns:
+            RateLimitResult: Whether the request is allowed and the quota state.
+        """
+        interval = time_window / max_requests
+        stripe = self._stripes[hash(key) % len(self._stripes)]
+
+        with stripe.lock:
+            if now is None:
+                now = time.monotonic()
+            tats = stripe.tats
+            tat = tats.get(key, now)
+            if tat < now:
+                tat = now
+            new_tat = tat + interval
+            allow_at = new_tat - time_window
+            if allow_at > now:
+                return RateLimitResult(False, 0, allow_at - now, tat - now)
+
+            tats[key] = new_tat
+            tats.move_to_end(key)
+            if len(tats) > self._max_stripe_keys:
+                tats.popitem(last=False)
+            if now >= stripe.next_sweep:
+                self._sweep(stripe, now)
+        return RateLimitResult(True, int((now - allow_at) / interval), 0.0, new_tat - now)
+
+    def _sweep(self, stripe: _Stripe, now: float):
+        # Keys are in least-recently-used order; stop at the first one still in use
+        tats = stripe.tats
+        while tats:
+            key, tat = next(iter(tats.items()))
+            if tat > now:
+                break
+            del tats[key]
+        stripe.next_sweep = now + self.sweep_interval
+
+
+_rate_limit_store = None
+
+
+def get_rate_limit_store():
+    """
+    Returns the backend selected by RATE_LIMIT_BACKEND, created on first use.
+    """
+    global _rate_limit_store
+    if _rate_limit_store is None:
+        from utils.limiter_backends import create_store
+        _rate_limit_store = create_store()
+    return _rate_limit_store
+
+
+async def close_rate_limit_store():
+    """
+    Closes the backend's connections, if it was created. Called from the app lifespan.
+    """
+    if _rate_limit_store is not None:
+        await _rate_limit_store.aclose()
+
+
+# Number of proxies in front of the app (e.g. 1 behind an ALB) whose X-Forwarded-For entries are trusted
+TRUSTED_PROXIES = int(os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "0"))
+
+
+class RateLimitPolicy(NamedTuple):
+    """
+    A quota applied to the key a request is identified by.
+
+    The key function receives the call's arguments by name and returns the
+    identity to limit, or None if the policy does not apply to the call.
+    Each policy has its own buckets, so one key can have a per-user and a
+    per-org quota at the same time.
+    """
+    name: str
+    max_requests: int
+    time_window: float
+    key: Callable[[dict], object]
+
+
+def by_arg(*names: str):
+    """
+    Key by one or more arguments of the call, whether passed by name or position.
+    """
+    if len(names) == 1:
+        name = names[0]
+        return lambda call: call.get(name)
+
+    def key(call):
+        values = tuple(call.get(name) for name in names)
+        return None if None in values else values
+    return key
+
+
+def _find_request(call: dict):
+    for value in call.values():
+        if isinstance(value, Request):
+            return value
+    return None
+
+
+def by_client_ip():
+    """
+    Key by the client address, taken from X-Forwarded-For when the app runs
+    behind RATE_LIMIT_TRUSTED_PROXIES proxies.
+    """
+    def key(call):
+        request = _find_request(call)
+        if request is None:
+            return None
+        forwarded = request.headers.get("x-forwarded-for")
+        if TRUSTED_PROXIES and forwarded:
+            hops = [hop.strip() for hop in forwarded.split(",")]
+            if len(hops) >= TRUSTED_PROXIES:
+                return hops[-TRUSTED_PROXIES]
+        return request.client.host if request.client else None
+    return key
+
+
+def by_token_subject(secret: str, algorithm: str = "HS256"):
+    """
+    Key by the subject of the bearer token, i.e. the logged-in user's email.
+    Requests without a valid token are not keyed.
+    """
+    return by_token_claim(secret, "sub", algorithm)
+
+
+def by_token_claim(secret: str, claim: str, algorithm: str = "HS256"):
+    """
+    Key by a claim of the bearer token, e.g. "org". Requests without a valid
+    token, or whose token lacks the claim, are not keyed.
+    """
+    def key(call):
+        request = _find_request(call)
+        if request is None:
+            return None
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return None
+        try:
+            return jwt.decode(token, secret, algorithms=[algorithm]).get(claim)
+        except jwt.PyJWTError:
+            return None
+    return key
+
+
+def by_org():
+    """
+    Key by the org argument of the call, or the org path or query parameter of the request.
+    """
+    def key(call):
+        if call.get("org"):
+            return call["org"]
+        request = _find_request(call)
+        if request is None:
+            return None
+        return request.path_params.get("org") or request.query_params.get("org")
+    return key
+
+
+def _policy_checks(policies: list[RateLimitPolicy], call: dict):
+    # The policy loop shared by check_policies and acheck_policies: yields the policy
+    # and store key to check, is sent back the result, and returns the outcome
+    tightest = None
+    for policy in policies:
+        key = policy.key(call)
+        if key is None:
+            continue
+        result = yield policy, f"{policy.name}:{key}"
+        if not result.allowed:
+            return policy, result
+        if tightest is None or result.remaining < tightest[1].remaining:
+            tightest = policy, result
+    return tightest
+
+
+def check_policies(policies: list[RateLimitPolicy], call: dict, store: RateLimitBackend = None):
+    """
+    Checks a call against every policy that applies to it.
+
+    Parameters:
+        policies (list[RateLimitPolicy]): The policies, narrowest first, so a request
+            rejected by a per-user quota does not count against the org's quota.
+        call (dict): The call's arguments by name.
+        store (RateLimitBackend, optional): Defaults to get_rate_limit_store().
+
+    Returns:
+        tuple[RateLimitPolicy, RateLimitResult] | None: The policy that rejected the
+            call, or else the one with the fewest requests remaining; None if no policy applies.
+    """
+    if store is None:
+        store = get_rate_limit_store()
+    checks, result = _policy_checks(policies, call), None
+    while True:
+        try:
+            policy, key = checks.send(result)
+        except StopIteration as done:
+            return done.value
+        result = store.check(key, policy.max_requests, policy.time_window)
+
+
+async def acheck_policies(policies: list[RateLimitPolicy], call: dict, store: RateLimitBackend = None):
+    """
+    Same as check_policies, for use on the event loop.
+    """
+    if store is None:
+        store = get_rate_limit_store()
+    checks, result = _policy_checks(policies, call), None
+    while True:
+        try:
+            policy, key = checks.send(result)
+        except StopIteration as done:
+            return done.value
+        result = await store.acheck(key, policy.max_requests, policy.time_window)
+
+
+def rate_limiter(max_requests: int = None, time_window: int = None, key=None, policies: list[RateLimitPolicy] = None):
     """
     Rate limiting decorator.
 
+    Either give a single quota with max_requests and time_window, keyed by
+    key (the user_id argument by default), or a list of policies.
+
     Parameters:
         max_requests (int): Maximum allowed requests within the time window.
         time_window (int): Time window in seconds.
+        key (callable, optional): Key function, see RateLimitPolicy.
+        policies (list[RateLimitPolicy], optional): Policies to apply instead of a single quota.
 
     Returns:
         function: A decorated function with rate limiting.
     """
     def decorator(func):
+        signature = inspect.signature(func)
+        func_policies = policies or [
+            RateLimitPolicy(func.__qualname__, max_requests, time_window, key or by_arg("user_id"))
+        ]
+
+        def rejected(limited, call):
+            if limited and not limited[1].allowed:
+                logger.warning("Rate limit %s exceeded for %s. Try again later.", limited[0].name, limited[0].key(call))
+                return True
+            return False
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                call = signature.bind_partial(*args, **kwargs).arguments
+                if rejected(await acheck_policies(func_policies, call), call):
+                    return {"error": "Rate limit exceeded. Try again later."}
+                return await func(*args, **kwargs)
+
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            user_id = kwargs.get('user_id')  # Identify user (modify as needed)
-            current_time = time.time()
-            
-            if user_id not in rate_limit_store:
-                rate_limit_store[user_id] = []
-            
-            request_times = rate_limit_store[user_id]
-            request_times = [t for t in request_times if current_time - t < time_window]
-
-            if len(request_times) >= max_requests:
-                logger.warning(f"Rate limit exceeded for user {user_id}. Try again later.")
+            call = signature.bind_partial(*args, **kwargs).arguments
+            if rejected(check_policies(func_policies, call), call):
                 return {"error": "Rate limit exceeded. Try again later."}
-
-            request_times.append(current_time)
-            rate_limit_store[user_id] = request_times
-
             return func(*args, **kwargs)
-        
+
         return wrapper
     return decorator
+
+
+class RateLimitExceeded(Exception):
+    """
+    Raised when a request cannot be admitted within the allowed wait.
+
+    Attributes:
+        retry_after (float): Seconds until the request could be admitted.
+    """
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBudget:
+    """
+    Async limiter for an upstream API with both a requests-per-minute and a
+    tokens-per-minute quota, such as OpenAI.
+
+    Both quotas are tracked with GCRA; a request costs one request plus its
+    estimated tokens, and is admitted only when both quotas allow it. Each
+    caller reserves the next free slot on arrival, so callers are admitted in
+    arrival order and max_wait bounds the whole wait, queue included. With the
+    "wait" policy a caller sleeps until its slot, unless that is more than
+    max_wait away; with "reject" it fails immediately. Either way a request that cannot be admitted in
+    time raises RateLimitExceeded without being sent upstream.
+
+    The state is per process, so each worker should get its share of the
+    upstream quota.
+
+    Parameters:
+        requests_per_minute (int): Upstream request quota.
+        tokens_per_minute (int): Upstream token quota.
+        policy (str): "wait" or "reject".
+        max_wait (float): Longest a caller may wait for its turn, in seconds.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, policy: str = "wait", max_wait: float = 10.0):
+        if policy not in ("wait", "reject"):
+            raise ValueError(f"Unknown policy '{policy}'. Use wait or reject.")
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.policy = policy
+        self.max_wait = max_wait
+        self._request_tat = 0.0
+        self._token_tat = 0.0
+        self._paused_until = 0.0
+
+    def _delay(self, tokens: int, now: float):
+        # Seconds until both quotas admit a request of this size
+        request_tat = max(self._request_tat, now) + 60.0 / self.requests_per_minute
+        token_tat = max(self._token_tat, now) + tokens * 60.0 / self.tokens_per_minute
+        return max(request_tat - 60.0 - now, token_tat - 60.0 - now, self._paused_until - now, 0.0)
+
+    async def acquire(self, tokens: int):
+        """
+        Waits until a request of the given estimated size fits in both quotas, and records it.
+
+        Parameters:
+            tokens (int): Estimated tokens of the request (prompt plus max_tokens).
+
+        Raises:
+            RateLimitExceeded: If the request does not fit within max_wait, or at once
+                under the "reject" policy, or is larger than the token quota itself.
+        """
+        if tokens > self.tokens_per_minute:
+            raise RateLimitExceeded(
+                f"Request of about {tokens} tokens exceeds the {self.tokens_per_minute} tokens per minute quota.", 60.0
+            )
+        # No await between computing the delay and reserving the slot, so this is atomic on the
+        # event loop; later callers see the reservation and queue behind it instead of on a lock
+        now = time.monotonic()
+        delay = self._delay(tokens, now)
+        if delay > 0 and (self.policy == "reject" or delay > self.max_wait):
+            logger.warning("Upstream budget exhausted; request of %s tokens needs %.1fs.", tokens, delay)
+            raise RateLimitExceeded("Upstream rate limit reached. Try again later.", delay)
+        admitted_at = now + delay
+        self._request_tat = max(self._request_tat, admitted_at) + 60.0 / self.requests_per_minute
+        self._token_tat = max(self._token_tat, admitted_at) + tokens * 60.0 / self.tokens_per_minute
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float):
+        """
+        Stops admitting requests for the given time, e.g. after the upstream
+        answered 429 with Retry-After, so the following calls wait instead of
+        being rejected upstream too.
+        """
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
@@ -0,0 +1,196 @@
+import os
+import time
+import asyncio
+import struct
+import hashlib
+import logging
+import threading
+import weakref
+from utils.limiter import RateLimitBackend, RateLimitResult, RateLimitStore
+
+logger = logging.getLogger('limiter')
+
+# GCRA as one atomic script, so each check is a single round-trip. The
+# server clock is used so that every worker and task agrees on the time.
+# KEYS[1] = key, ARGV[1] = emission interval (s), ARGV[2] = time window (s).
+# Fractional values are returned as strings because Lua numbers are
+# truncated to integers in replies.
+GCRA_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local interval = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if not tat or tat < now then
+    tat = now
+end
+local new_tat = tat + interval
+local allow_at = new_tat - window
+if allow_at > now then
+    return {0, 0, tostring(allow_at - now), tostring(tat - now)}
+end
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil((new_tat - now) * 1000))
+return {1, math.floor((now - allow_at) / interval), '0', tostring(new_tat - now)}
+"""
+
+
+def _result(reply):
+    allowed, remaining, retry_after, reset_after = reply
+    return RateLimitResult(bool(int(allowed)), int(remaining), float(retry_after), float(reset_after))
+
+
+class RedisStore(RateLimitBackend):
+    """
+    Rate limit state in Redis (or any server speaking the Redis protocol and
+    Lua scripting), shared by every worker and task that uses the same server.
+    Keys expire on their own once they are idle.
+
+    Parameters:
+        url (str): The server URL, e.g. redis://localhost:6379/0.
+        prefix (str): Prefix for every key written.
+    """
+
+    def __init__(self, url: str, prefix: str = "px:rl:"):
+        import redis
+
+        self.url = url
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(GCRA_SCRIPT)
+        # asyncio connections belong to the loop that opened them, so each loop gets its own client
+        self._async_clients = weakref.WeakKeyDictionary()  # event loop -> (client, script)
+
+    def check(self, key: str, max_requests: int, time_window: float):
+        return _result(self._script(keys=[self.prefix + key], args=[time_window / max_requests, time_window]))
+
+    async def acheck(self, key: str, max_requests: int, time_window: float):
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_clients:
+            import redis.asyncio
+            client = redis.asyncio.Redis.from_url(self.url)
+            self._async_clients[loop] = client, client.register_script(GCRA_SCRIPT)
+        script = self._async_clients[loop][1]
+        return _result(await script(keys=[self.prefix + key], args=[time_window / max_requests, time_window]))
+
+    async def aclose(self):
+        # Clients of other loops are closed on their own loop, or dropped with a closed one
+        loop = asyncio.get_running_loop()
+        for client_loop, (client, _) in list(self._async_clients.items()):
+            del self._async_clients[client_loop]
+            if client_loop is loop:
+                await client.aclose()
+            elif client_loop.is_running():
+                asyncio.run_coroutine_threadsafe(client.aclose(), client_loop)
+
+
+class SharedMemoryStore(RateLimitBackend):
+    """
+    Rate limit state in a shared memory segment, shared by every worker
+    process on the host.
+
+    The segment is a fixed-size open-addressing table of (key fingerprint,
+    TAT) slots, so its memory never grows. A slot whose TAT has passed is
+    free to reuse; when all slots in a key's probe window are in use, the one
+    that frees up soonest is evicted. Updates are serialized with a file lock
+    across processes and a thread lock within one.
+
+    Parameters:
+        name (str): Name of the shared memory segment; workers using the same name share state.
+        slots (int): Number of slots in the table.
+        probe (int): Number of slots searched for a key before evicting.
+    """
+
+    SLOT = struct.Struct("Qd")  # key fingerprint (0 = empty), TAT in epoch seconds
+
+    def __init__(self, name: str = "px_rate_limit", slots: int = 65536, probe: int = 8):
+        import fcntl
+        from multiprocessing import resource_tracker, shared_memory
+
+        self._fcntl = fcntl
+        self.slots = slots
+        self.probe = probe
+        size = slots * self.SLOT.size
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=name)
+        # The segment outlives any one worker; keep the resource tracker from unlinking it on exit
+        resource_tracker.unregister(self._shm._name, "shared_memory")
+        self._buffer = self._shm.buf
+        self._lock_file = open(os.path.join("/tmp", f"{name}.lock"), "a+b")
+        self._thread_lock = threading.Lock()
+
+    def _fingerprint(self, key: str):
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+
+    async def acheck(self, key: str, max_requests: int, time_window: float):
+        # flock blocks while another worker holds the lock, so wait for it off the event loop
+        return await asyncio.to_thread(self.check, key, max_requests, time_window)
+
+    def check(self, key: str, max_requests: int, time_window: float):
+        fingerprint = self._fingerprint(key)
+        interval = time_window / max_requests
+        slot_size = self.SLOT.size
+        start = fingerprint % self.slots
+
+        with self._thread_lock:
+            self._fcntl.flock(self._lock_file, self._fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                found = free = oldest = None
+                for i in range(self.probe):
+                    offset = ((start + i) % self.slots) * slot_size
+                    slot_fingerprint, slot_tat = self.SLOT.unpack_from(self._buffer, offset)
+                    if slot_fingerprint == fingerprint:
+                        found = offset, slot_tat
+                        break
+                    if free is None and (slot_fingerprint == 0 or slot_tat <= now):
+                        free = offset
+                    if oldest is None or slot_tat < oldest[1]:
+                        oldest = offset, slot_tat
+
+                if found:
+                    offset, tat = found
+                else:
+                    offset, tat = (free if free is not None else oldest[0]), now
+                if tat < now:
+                    tat = now
+                new_tat = tat + interval
+                allow_at = new_tat - time_window
+                if allow_at > now:
+                    return RateLimitResult(False, 0, allow_at - now, tat - now)
+
+                self.SLOT.pack_into(self._buffer, offset, fingerprint, new_tat)
+                return RateLimitResult(True, int((now - allow_at) / interval), 0.0, new_tat - now)
+            finally:
+                self._fcntl.flock(self._lock_file, self._fcntl.LOCK_UN)
+
+
+def create_store():
+    """
+    Creates the rate limit backend selected by the environment:
+
+        RATE_LIMIT_BACKEND=memory (default)  per-process state (RATE_LIMIT_MAX_KEYS, RATE_LIMIT_STRIPES)
+        RATE_LIMIT_BACKEND=shm               shared by the workers on one host (RATE_LIMIT_SHM_NAME, RATE_LIMIT_SHM_SLOTS)
+        RATE_LIMIT_BACKEND=redis             shared by every task (RATE_LIMIT_REDIS_URL)
+    """
+    backend = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+    if backend == "redis":
+        url = os.getenv("RATE_LIMIT_REDIS_URL")
+        if not url:
+            raise RuntimeError("RATE_LIMIT_REDIS_URL environment variable is not set. Please define it in your .env file.")
+        logger.info("Using Redis rate limit backend")
+        return RedisStore(url)
+    if backend == "shm":
+        logger.info("Using shared memory rate limit backend")
+        return SharedMemoryStore(
+            name=os.getenv("RATE_LIMIT_SHM_NAME", "px_rate_limit"),
+            slots=int(os.getenv("RATE_LIMIT_SHM_SLOTS", "65536"))
+        )
+    if backend != "memory":
+        raise RuntimeError(f"Unknown RATE_LIMIT_BACKEND '{backend}'. Use memory, shm or redis.")
+    return RateLimitStore(
+        max_keys=int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000")),
+        sweep_interval=float(os.getenv("RATE_LIMIT_SWEEP_SECONDS", "60")),
+        stripes=int(os.getenv("RATE_LIMIT_STRIPES", "16"))
+    )
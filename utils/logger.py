@@ -1,39 +1,529 @@
+import atexit
+import copy
+import glob
+import gzip
+import itertools
+import logging
 import logging.config
+import logging.handlers
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from dotenv import load_dotenv
 
-LOGGING_CONFIG = {
-    'version': 1,
-    'disable_existing_loggers': False,
-    'formatters': {
-        'standard': {
-                        'format': '%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s'
-        },
+try:
+    import orjson
+except ImportError:  # optional; JsonFormatter falls back to json
+    orjson = None
+    import json
+
+load_dotenv()
+
+# Logging profile: "development" (everything at DEBUG) or "production" (INFO, quiet libraries)
+LOG_PROFILE = os.getenv("LOG_PROFILE", "development").lower()
+
+LOG_PROFILES = {
+    'development': {
+        'level': 'DEBUG',
+        'handlers': ['console', 'file'],
+        'format': 'text',
+        'levels': {},
+        'sample': {},
     },
-    'handlers': {
-        'console': {
-            'level': 'DEBUG',
-            'class': 'logging.StreamHandler',
-            'formatter': 'standard',
+    'production': {
+        'level': 'INFO',
+        'handlers': ['console', 'file'],
+        'format': 'json',
+        'levels': {
+            'asyncio': 'WARNING',
+            'httpcore': 'WARNING',
+            'httpx': 'WARNING',
+            'multipart': 'WARNING',
+            'sqlalchemy': 'WARNING',
         },
-        'file': {
-            'level': 'DEBUG',
-            'class': 'logging.FileHandler',
-            'formatter': 'standard',
-            'filename': 'app.log',
+        # Keep 1 in N records below WARNING, by logger name or "logger:function" call site
+        'sample': {
+            'px:load_user': 100,
+            'manage_user:return_user_by_email': 100,
+            'openai_api:call_openai_api': 100,
         },
     },
-    'loggers': {
-        '': {  # root logger
-            'handlers': ['console', 'file'],
-            'level': 'DEBUG',
-            'propagate': True
+}
+
+# Repeats of a warning from the same call site are suppressed for this many seconds (0 disables)
+LOG_WARNING_INTERVAL = float(os.getenv("LOG_WARNING_INTERVAL", "60"))
+# String arguments longer than this are truncated in log lines (0 disables)
+LOG_MAX_PAYLOAD = int(os.getenv("LOG_MAX_PAYLOAD", "2000"))
+
+
+# The log file is rotated once it reaches LOG_MAX_BYTES or is LOG_ROTATE_SECONDS old (0 disables either)
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+LOG_ROTATE_SECONDS = float(os.getenv("LOG_ROTATE_SECONDS", "86400"))
+# Number of compressed rotated files to keep
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "14"))
+
+_compress_executor = None
+
+
+def _compress_segment(path: str, base_filename: str, backup_count: int):
+    # Runs on the compression thread: gzip one rotated file, then prune old ones
+    try:
+        with open(path, "rb") as source, gzip.open(f"{path}.gz.tmp", "wb") as target:
+            shutil.copyfileobj(source, target)
+        os.replace(f"{path}.gz.tmp", f"{path}.gz")
+        os.remove(path)
+        if backup_count:
+            segments = sorted(glob.glob(f"{glob.escape(base_filename)}.*.gz"), key=os.path.getmtime)
+            for old in segments[:-backup_count]:
+                os.remove(old)
+    except OSError as e:
+        # Logging from here could rotate again; report like logging.Handler.handleError does
+        sys.stderr.write(f"Failed to compress rotated log {path}: {e}\n")
+
+
+class CompressingRotatingFileHandler(logging.handlers.BaseRotatingHandler):
+    """
+    File handler that starts a new file once the current one reaches
+    max_bytes or has been open for rotate_seconds.
+
+    The full file is renamed to <filename>.<timestamp> and gzipped on a
+    background thread, so a rotation costs the writing thread a rename, not
+    a compression. Only the newest backup_count compressed files are kept.
+
+    Parameters:
+        filename (str): Path of the active log file.
+        max_bytes (int): Size that triggers a rotation; 0 disables size-based rotation.
+        rotate_seconds (float): Age that triggers a rotation; 0 disables time-based rotation.
+        backup_count (int): Compressed files to keep; 0 keeps all of them.
+    """
+
+    def __init__(self, filename: str, max_bytes: int = 0, rotate_seconds: float = 0, backup_count: int = 0,
+                 encoding: str = None, delay: bool = False):
+        super().__init__(filename, "a", encoding=encoding, delay=delay)
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backup_count = backup_count
+        self.rollover_at = time.time() + rotate_seconds
+
+    def shouldRollover(self, record):
+        if self.rotate_seconds and time.time() >= self.rollover_at:
+            return True
+        if self.max_bytes:
+            if self.stream is None:
+                self.stream = self._open()
+            # Checked before writing, so a file can exceed max_bytes by one record
+            return self.stream.tell() >= self.max_bytes
+        return False
+
+    def doRollover(self):
+        global _compress_executor
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+        if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename):
+            stamp = time.strftime("%Y%m%d-%H%M%S")
+            segment, n = f"{self.baseFilename}.{stamp}", 1
+            while os.path.exists(segment) or os.path.exists(f"{segment}.gz"):
+                segment, n = f"{self.baseFilename}.{stamp}-{n}", n + 1
+            os.rename(self.baseFilename, segment)
+
+            if _compress_executor is None:
+                _compress_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="log-compress")
+            try:
+                _compress_executor.submit(_compress_segment, segment, self.baseFilename, self.backup_count)
+            except RuntimeError:
+                # The executor is shut down at interpreter exit, before the listener's final flush
+                _compress_segment(segment, self.baseFilename, self.backup_count)
+
+        self.rollover_at = time.time() + self.rotate_seconds
+        if not self.delay:
+            self.stream = self._open()
+
+
+def _parse_pairs(value: str):
+    # "httpx=WARNING,manage_user=DEBUG" -> {"httpx": "WARNING", "manage_user": "DEBUG"}
+    pairs = {}
+    for item in value.split(","):
+        if item.strip():
+            name, _, setting = item.partition("=")
+            pairs[name.strip()] = setting.strip()
+    return pairs
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps 1 in N records below WARNING for the configured loggers or call
+    sites; warnings and errors always pass.
+
+    Parameters:
+        rates (dict[str, int]): N by logger name or "logger:function". A call
+            site rate takes precedence over its logger's rate.
+    """
+
+    def __init__(self, rates: dict[str, int]):
+        super().__init__()
+        self.rates = {key: int(rate) for key, rate in rates.items() if int(rate) > 1}
+        self._counters = {key: itertools.count() for key in self.rates}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        key = f"{record.name}:{record.funcName}"
+        if key not in self.rates:
+            key = record.name
+            if key not in self.rates:
+                return True
+        return next(self._counters[key]) % self.rates[key] == 0
+
+
+class WarningRateLimitFilter(logging.Filter):
+    """
+    Lets a WARNING from a given call site through at most once per interval.
+    The next one that passes says how many were suppressed in between.
+
+    Parameters:
+        interval (float): Seconds between warnings from one call site.
+    """
+
+    def __init__(self, interval: float):
+        super().__init__()
+        self.interval = interval
+        self._sites = {}  # (logger, path, line) -> [last emitted, suppressed since]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno != logging.WARNING or not self.interval:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None:
+                self._sites[key] = [now, 0]
+                return True
+            if now - site[0] < self.interval:
+                site[1] += 1
+                return False
+            suppressed = site[1]
+            site[0], site[1] = now, 0
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar warnings suppressed)"
+        return True
+
+
+class TruncateFilter(logging.Filter):
+    """
+    Shortens string arguments, and messages without arguments, to max_length
+    characters, so large payloads are not formatted or written in full.
+
+    Parameters:
+        max_length (int): Longest string kept as is.
+    """
+
+    def __init__(self, max_length: int):
+        super().__init__()
+        self.max_length = max_length
+
+    def _truncate(self, value):
+        if isinstance(value, str) and len(value) > self.max_length:
+            return f"{value[:self.max_length]}... [{len(value) - self.max_length} more characters]"
+        return value
+
+    def filter(self, record):
+        if not self.max_length:
+            return True
+        if isinstance(record.args, tuple):
+            record.args = tuple(self._truncate(arg) for arg in record.args)
+        elif not record.args:
+            record.msg = self._truncate(record.msg)
+        return True
+
+
+# Fields of the request being handled (request_id, route, org, ...), set by RequestLoggingMiddleware
+request_context: ContextVar = ContextVar("request_context", default=None)
+
+
+def set_log_context(**fields):
+    """
+    Adds fields, e.g. org or model, to the log context of the current
+    request; they appear on its remaining records and its summary line.
+    Does nothing outside a request.
+    """
+    context = request_context.get()
+    if context is not None:
+        context.update(fields)
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Copies the current request context onto the record as record.context.
+    It must run in the logging thread, before the record is queued.
+    """
+
+    def filter(self, record):
+        context = request_context.get()
+        record.context = dict(context) if context else {}
+        return True
+
+
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "context", "taskName"}
+
+
+def _dumps(entry: dict):
+    if orjson:
+        return orjson.dumps(entry, default=str).decode()
+    return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON object: time, level, logger, message and
+    location, then the request context and any extra= fields. Serialized
+    with orjson when it is installed.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "location": f"{record.filename}:{record.lineno}",
+        }
+        entry.update(getattr(record, "context", None) or {})
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return _dumps(entry)
+
+
+def build_log_filters(profile: str = None):
+    """
+    Builds the filters applied to every record before it is queued:
+    sampling per the profile and LOG_SAMPLE (e.g. manage_user=100,px:load_user=10),
+    warning suppression per LOG_WARNING_INTERVAL, truncation per
+    LOG_MAX_PAYLOAD and the request context.
+
+    Parameters:
+        profile (str): A key of LOG_PROFILES; defaults to LOG_PROFILE.
+
+    Returns:
+        list[logging.Filter]: The filters, cheapest rejection first.
+    """
+    settings = LOG_PROFILES[profile or LOG_PROFILE]
+    rates = {**settings['sample'], **_parse_pairs(os.getenv("LOG_SAMPLE", ""))}
+    return [
+        SamplingFilter(rates),
+        WarningRateLimitFilter(LOG_WARNING_INTERVAL),
+        TruncateFilter(LOG_MAX_PAYLOAD),
+        RequestContextFilter(),
+    ]
+
+
+def build_logging_config(profile: str = None):
+    """
+    Builds the dictConfig for a logging profile, with overrides from the environment:
+
+        LOG_LEVEL    root level, e.g. INFO
+        LOG_LEVELS   per-logger levels, e.g. httpx=WARNING,manage_user=DEBUG
+        LOG_HANDLERS comma-separated handlers to use: console, file
+        LOG_FILE     path of the log file (default app.log)
+        LOG_FORMAT   text (the standard format) or json
+
+    The file is rotated and compressed per LOG_MAX_BYTES, LOG_ROTATE_SECONDS
+    and LOG_BACKUP_COUNT.
+
+    Parameters:
+        profile (str): A key of LOG_PROFILES; defaults to LOG_PROFILE.
+
+    Returns:
+        dict: A logging.config.dictConfig configuration.
+    """
+    profile = profile or LOG_PROFILE
+    if profile not in LOG_PROFILES:
+        raise RuntimeError(f"Unknown LOG_PROFILE '{profile}'. Use {' or '.join(LOG_PROFILES)}.")
+    settings = LOG_PROFILES[profile]
+
+    level = os.getenv("LOG_LEVEL", settings['level']).upper()
+    handlers = [name.strip() for name in os.getenv("LOG_HANDLERS", ",".join(settings['handlers'])).split(",") if name.strip()]
+    formatter = 'json' if os.getenv("LOG_FORMAT", settings['format']).lower() == 'json' else 'standard'
+    levels = {**settings['levels'], **{name: setting.upper() for name, setting in _parse_pairs(os.getenv("LOG_LEVELS", "")).items()}}
+
+    return {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'formatters': {
+            'standard': {
+                'format': '%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s'
+            },
+            'json': {
+                '()': 'utils.logger.JsonFormatter',
+            },
         },
-        'my_module': {
-            'handlers': ['console', 'file'],
-            'level': 'DEBUG',
-            'propagate': False
+        'handlers': {
+            'console': {
+                'level': 'DEBUG',
+                'class': 'logging.StreamHandler',
+                'formatter': formatter,
+            },
+            'file': {
+                'level': 'DEBUG',
+                'class': 'utils.logger.CompressingRotatingFileHandler',
+                'formatter': formatter,
+                'filename': os.getenv("LOG_FILE", "app.log"),
+                'max_bytes': LOG_MAX_BYTES,
+                'rotate_seconds': LOG_ROTATE_SECONDS,
+                'backup_count': LOG_BACKUP_COUNT,
+            },
         },
+        'loggers': {
+            '': {  # root logger
+                'handlers': handlers,
+                'level': level,
+                'propagate': True
+            },
+            'my_module': {
+                'handlers': handlers,
+                'level': level,
+                'propagate': False
+            },
+            **{name: {'level': logger_level} for name, logger_level in levels.items()},
+        }
     }
-}
 
-def setup_logging():
+
+LOGGING_CONFIG = build_logging_config()
+
+# Records waiting to be written; when full, LOG_QUEUE_OVERFLOW decides what happens
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# "drop": discard new records below ERROR; "block": wait up to LOG_QUEUE_BLOCK_SECONDS for space
+LOG_QUEUE_OVERFLOW = os.getenv("LOG_QUEUE_OVERFLOW", "drop")
+LOG_QUEUE_BLOCK_SECONDS = float(os.getenv("LOG_QUEUE_BLOCK_SECONDS", "0.1"))
+
+
+_exception_formatter = logging.Formatter()
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to a bounded queue so the calling thread never waits on
+    disk or console I/O; a QueueListener thread does the writing.
+
+    When the queue is full, records below ERROR are dropped under the
+    "drop" policy, while errors, and every record under the "block" policy,
+    wait up to block_timeout for space before being dropped. The number of
+    dropped records is logged once the queue has room again.
+    """
+
+    def __init__(self, log_queue: queue.Queue, overflow: str = "drop", block_timeout: float = 0.1):
+        super().__init__(log_queue)
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record):
+        # The stock prepare() formats the record, folding the traceback into msg and
+        # dropping exc_info; keep them apart so the listener's formatter (text or JSON)
+        # renders the exception itself. exc_text holds the traceback as a string, so the
+        # queued record does not keep the failing frames alive.
+        if record.exc_info and not record.exc_text:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self.overflow == "block" or record.levelno >= logging.ERROR:
+                self.queue.put(record, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+            return
+
+        if self.dropped:
+            with self._dropped_lock:
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                warning = logging.makeLogRecord({
+                    "name": __name__, "levelno": logging.WARNING, "levelname": "WARNING",
+                    "msg": f"Log queue was full; dropped {dropped} records."
+                })
+                try:
+                    self.queue.put_nowait(warning)
+                except queue.Full:
+                    with self._dropped_lock:
+                        self.dropped += dropped
+
+
+_listener = None
+_configured = False
+
+
+def _stop_listener():
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(_stop_listener)
+
+
+def setup_logging(force: bool = False):
+    """
+    Applies LOGGING_CONFIG, then moves its handlers behind a queue so that
+    logging calls only enqueue a record and the writes happen on a
+    background listener thread. Sampling, warning suppression and
+    truncation filters run before a record is queued.
+
+    Only the first call configures logging; later calls return immediately
+    unless force is set.
+
+    Parameters:
+        force (bool): Reconfigure even if logging is already set up.
+    """
+    global _listener, _configured
+    if _configured and not force:
+        return
+    # Flush and stop the previous listener before its handlers are replaced
+    _stop_listener()
+
     logging.config.dictConfig(LOGGING_CONFIG)
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = BoundedQueueHandler(log_queue, LOG_QUEUE_OVERFLOW, LOG_QUEUE_BLOCK_SECONDS)
+    for log_filter in build_log_filters():
+        queue_handler.addFilter(log_filter)
+    handlers = []
+    for name in LOGGING_CONFIG['loggers']:
+        logger = logging.getLogger(name or None)
+        if not logger.handlers:
+            continue
+        for handler in logger.handlers:
+            if handler not in handlers:
+                handlers.append(handler)
+        logger.handlers = [queue_handler]
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    _configured = True
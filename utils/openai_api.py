@@ -1,7 +1,20 @@
 import os
+import json
+import random
+import asyncio
+import weakref
 import httpx
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
 from dotenv import load_dotenv
-from utils.logger import setup_logging
+from utils.logger import set_log_context, setup_logging
+from utils.limiter import RateLimitExceeded, TokenBudget
+from utils.openai_cache import cache_key, cacheable, response_cache
+from utils.single_flight import SingleFlight
+from utils.admission import AdmissionController, AdmissionRejected
+from utils.circuit_breaker import CircuitBreaker, CircuitOpen
+from utils.tokens import PromptTooLong, count_tokens, fit_input
+from utils.usage import openai_usage
 import logging
 
 setup_logging()
@@ -12,30 +25,538 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     raise RuntimeError("OPENAI_API_KEY environment variable is not set. Please define it in your .env file.")
 
-async def call_openai_api(model: str, prompt: str, text: str, temperature: float, max_tokens: int):
-    logger.info(f"Receiving prompt: {prompt} and text: {text}, model: {model}, temperature: {temperature}, max_tokens: {max_tokens}")
-    url = "https://api.openai.com/v1/chat/completions"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {OPENAI_API_KEY}"
-    }
+# This worker's share of the upstream quota; requests over it wait up to
+# OPENAI_LIMIT_MAX_WAIT seconds ("wait") or fail at once ("reject")
+openai_budget = TokenBudget(
+    requests_per_minute=int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "500")),
+    tokens_per_minute=int(os.getenv("OPENAI_TOKENS_PER_MINUTE", "30000")),
+    policy=os.getenv("OPENAI_LIMIT_POLICY", "wait"),
+    max_wait=float(os.getenv("OPENAI_LIMIT_MAX_WAIT", "10"))
+)
+
+# Upstream API; point at dev/openai_mock.py for local testing
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+# Connection pool shared by all calls from this worker
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "20"))
+OPENAI_KEEPALIVE_SECONDS = float(os.getenv("OPENAI_KEEPALIVE_SECONDS", "30"))
+# Seconds to connect, and to wait for each read of the response (OPENAI_TIMEOUT is the old single setting)
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_READ_TIMEOUT = float(os.getenv("OPENAI_READ_TIMEOUT", os.getenv("OPENAI_TIMEOUT", "40")))
+OPENAI_WRITE_TIMEOUT = float(os.getenv("OPENAI_WRITE_TIMEOUT", "10"))
+OPENAI_POOL_TIMEOUT = float(os.getenv("OPENAI_POOL_TIMEOUT", "10"))
+# Transient failures (connection errors, 429, 5xx) are retried up to OPENAI_MAX_RETRIES times, with
+# jittered exponential backoff from OPENAI_RETRY_BASE_DELAY seconds, or the upstream's Retry-After
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+OPENAI_RETRY_BASE_DELAY = float(os.getenv("OPENAI_RETRY_BASE_DELAY", "0.5"))
+# Longest wait before a retry; a longer Retry-After fails the call instead
+OPENAI_RETRY_MAX_DELAY = float(os.getenv("OPENAI_RETRY_MAX_DELAY", "8"))
+# Calls to a model fail fast for OPENAI_BREAKER_RESET_SECONDS after OPENAI_BREAKER_FAILURES consecutive failures
+OPENAI_BREAKER_FAILURES = int(os.getenv("OPENAI_BREAKER_FAILURES", "5"))
+OPENAI_BREAKER_RESET_SECONDS = float(os.getenv("OPENAI_BREAKER_RESET_SECONDS", "30"))
+# HTTP/2 needs the h2 package (pip install httpx[http2])
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "false").lower() in ("1", "true", "yes")
+# Upstream calls allowed at once per worker; more wait up to OPENAI_QUEUE_TIMEOUT seconds
+# in a queue of OPENAI_MAX_QUEUED, premium first, then regular, then anonymous
+OPENAI_MAX_IN_FLIGHT = int(os.getenv("OPENAI_MAX_IN_FLIGHT", "50"))
+OPENAI_MAX_QUEUED = int(os.getenv("OPENAI_MAX_QUEUED", "200"))
+OPENAI_QUEUE_TIMEOUT = float(os.getenv("OPENAI_QUEUE_TIMEOUT", "10"))
+# Identical requests arriving while one is in flight share its upstream call
+OPENAI_COALESCE = os.getenv("OPENAI_COALESCE", "true").lower() in ("1", "true", "yes")
+# Largest batch accepted, and most items of one batch sent upstream at once
+OPENAI_BATCH_MAX_ITEMS = int(os.getenv("OPENAI_BATCH_MAX_ITEMS", "500"))
+OPENAI_BATCH_CONCURRENCY = int(os.getenv("OPENAI_BATCH_CONCURRENCY", "8"))
+
+SYSTEM_PROMPT = "Assistant is a helpful AI."
+
+# Pooled connections belong to the event loop that opened them, so each loop gets its own
+# client; a loop's client is dropped with the loop and the rest closed by close_openai_client
+_clients = weakref.WeakKeyDictionary()  # event loop -> httpx.AsyncClient
+
+openai_flights = SingleFlight()
+openai_admission = AdmissionController(OPENAI_MAX_IN_FLIGHT, OPENAI_MAX_QUEUED, OPENAI_QUEUE_TIMEOUT)
+openai_breakers = {}  # model -> CircuitBreaker
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def _create_client():
+    limits = httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+        keepalive_expiry=OPENAI_KEEPALIVE_SECONDS
+    )
+    timeout = httpx.Timeout(connect=OPENAI_CONNECT_TIMEOUT, read=OPENAI_READ_TIMEOUT,
+                            write=OPENAI_WRITE_TIMEOUT, pool=OPENAI_POOL_TIMEOUT)
+    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}"}
+    try:
+        return httpx.AsyncClient(base_url=OPENAI_BASE_URL, headers=headers, limits=limits,
+                                 timeout=timeout, http2=OPENAI_HTTP2)
+    except ImportError:
+        logger.warning("OPENAI_HTTP2 is set but the h2 package is not installed; using HTTP/1.1.")
+        return httpx.AsyncClient(base_url=OPENAI_BASE_URL, headers=headers, limits=limits, timeout=timeout)
+
+
+async def open_openai_client():
+    """
+    Creates the shared upstream client of the running loop. Called from the app lifespan.
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.pop(loop, None)
+    if client is not None:
+        await client.aclose()
+    _clients[loop] = _create_client()
+
+
+async def close_openai_client():
+    """
+    Closes the upstream clients and their pooled connections. Called from the app lifespan.
+
+    The running loop's client is awaited; those of other running loops are closed on
+    their own loop, and those of closed loops just dropped, as their transports are gone.
+    """
+    loop = asyncio.get_running_loop()
+    for client_loop, client in list(_clients.items()):
+        del _clients[client_loop]
+        if client_loop is loop:
+            await client.aclose()
+        elif client_loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.aclose(), client_loop)
+
+
+def get_openai_client():
+    """
+    Returns the running loop's upstream client, creating one if the lifespan has not
+    (e.g. when the app runs without lifespan events, or on another loop).
+
+    Returns:
+        httpx.AsyncClient: A client with a keep-alive connection pool for OPENAI_BASE_URL.
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = _create_client()
+    return client
+
+
+def _chat_request(model: str, prompt: str, text: str, temperature: float, max_tokens: int, stream: bool = False):
+    # Returns the request body and its input tokens; raises PromptTooLong per utils.tokens.fit_input
+    set_log_context(model=model)
+    logger.debug("Receiving prompt of %s characters and text of %s characters, model: %s, temperature: %s, max_tokens: %s",
+                 len(prompt), len(text), model, temperature, max_tokens)
+    logger.debug("Prompt: %s, text: %s", prompt, text)
+    text, input_tokens = fit_input(model, SYSTEM_PROMPT, prompt, text, max_tokens)
     data = {
         "model": model,
         "messages": [
-            {"role": "system", "content": "Assistant is a helpful AI."},
+            {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": f"{prompt} : {text}"}
         ],
         "temperature": temperature,
         "max_tokens": max_tokens  # token for no user (no login), regular user and premium user can adjust this
     }
+    if stream:
+        data["stream"] = True
+        # Upstream then sends the token usage in a last chunk
+        data["stream_options"] = {"include_usage": True}
+    return data, input_tokens
+
+
+def _record_usage(org: str, data: dict, usage: dict, input_tokens: int, ai_content: str):
+    # Upstream's counts when it sent them, otherwise our own
+    usage = usage or {}
+    prompt_tokens = usage.get("prompt_tokens", input_tokens)
+    completion_tokens = usage.get("completion_tokens", count_tokens(ai_content, data["model"]) if ai_content else 0)
+    openai_usage.record(org, data["model"], prompt_tokens, completion_tokens)
+
+
+def retry_after_seconds(response: httpx.Response):
+    """
+    Seconds from retry-after-ms, or Retry-After as seconds or an HTTP date; None if absent or invalid.
+    """
     try:
-        async with httpx.AsyncClient(timeout=40.0) as client:
-            response = await client.post(url, headers=headers, json=data)
+        if response.headers.get("retry-after-ms"):
+            return max(float(response.headers["retry-after-ms"]) / 1000, 0.0)
+        value = response.headers.get("retry-after")
+        if not value:
+            return None
+        if value.replace(".", "", 1).isdigit():
+            return float(value)
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _pause_on_rate_limit(response: httpx.Response):
+    if response.status_code == 429:
+        retry_after = retry_after_seconds(response)
+        openai_budget.pause(retry_after if retry_after is not None else 1.0)
+
+
+def _backoff(attempt: int):
+    # "Full jitter": a random delay up to the exponential bound
+    return random.uniform(0, min(OPENAI_RETRY_MAX_DELAY, OPENAI_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def _retry_delay(response: httpx.Response, attempt: int):
+    """
+    Seconds to wait before retrying a failed response, or None if it should not be retried.
+    """
+    if response.status_code not in RETRY_STATUSES:
+        return None
+    if response.status_code == 429:
+        try:
+            code = response.json().get("error", {}).get("code")
+        except ValueError:
+            code = None
+        # Out of credits, not a transient rate limit
+        if code == "insufficient_quota":
+            return None
+    retry_after = retry_after_seconds(response)
+    if retry_after is None:
+        return _backoff(attempt)
+    return retry_after if retry_after <= OPENAI_RETRY_MAX_DELAY else None
+
+
+def _breaker(model: str):
+    breaker = openai_breakers.get(model)
+    if breaker is None:
+        breaker = openai_breakers[model] = CircuitBreaker(f"OpenAI model {model}", OPENAI_BREAKER_FAILURES,
+                                                          OPENAI_BREAKER_RESET_SECONDS)
+    return breaker
+
+
+async def _send_chat(data: dict, stream: bool = False):
+    """
+    Sends a chat request, retrying connection errors, 429s and 5xx responses
+    with backoff, through the model's circuit breaker. Timeouts while reading
+    are not retried.
+
+    Returns:
+        httpx.Response: A successful response; with stream, its body is not read yet.
+
+    Raises:
+        CircuitOpen: The model's circuit is open.
+        httpx.HTTPStatusError: Upstream rejected the request and it was not retried, or retries ran out.
+        httpx.TransportError: Upstream could not be reached and retries ran out.
+    """
+    breaker = _breaker(data["model"])
+    client = get_openai_client()
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        breaker.check()
+        try:
+            response = await client.send(client.build_request("POST", "/chat/completions", json=data), stream=stream)
+        except httpx.PoolTimeout:
+            # Our own connection pool is exhausted; says nothing about upstream health
+            raise
+        except httpx.TransportError as e:
+            breaker.record_failure()
+            retryable = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError))
+            if not retryable or attempt == OPENAI_MAX_RETRIES:
+                raise
+            delay = _backoff(attempt)
+            logger.warning("Upstream call failed with %s; retry %s in %.2fs.", type(e).__name__, attempt + 1, delay)
+            await asyncio.sleep(delay)
+            continue
+
+        if not response.is_error:
+            breaker.record_success()
+            return response
+        if stream:
+            await response.aread()
+            await response.aclose()
+        if response.status_code >= 500:
+            breaker.record_failure()
+        elif response.status_code != 429:
+            breaker.record_success()
+        _pause_on_rate_limit(response)
+        delay = _retry_delay(response, attempt)
+        if delay is None or attempt == OPENAI_MAX_RETRIES:
             response.raise_for_status()
-            result = response.json()
-            ai_content = result["choices"][0]["message"]["content"].strip()
-            logger.info(f"Response from AI: {ai_content}")
-            return {"response": ai_content}
+        logger.warning("Upstream call failed with %s; retry %s in %.2fs.", response.status_code, attempt + 1, delay)
+        await asyncio.sleep(delay)
+
+
+async def _cached_response(model: str, prompt: str, text: str, temperature: float, max_tokens: int, cache: bool):
+    # Returns (key, cached response); key is None when the request is not cacheable
+    if not cacheable(temperature, cache):
+        return None, None
+    key = cache_key(model, SYSTEM_PROMPT, prompt, text, temperature, max_tokens)
+    ai_content, tier = await response_cache.get(key)
+    set_log_context(cache=f"{tier}_hit" if tier else "miss")
+    return key, ai_content
+
+
+async def call_openai_api(model: str, prompt: str, text: str, temperature: float, max_tokens: int,
+                          cache: bool = None, tier: str = "regular", org: str = ""):
+    """
+    Answers a chat request from the cache or upstream. Concurrent identical
+    requests share one call unless OPENAI_COALESCE is off or cache is False.
+
+    Parameters:
+        cache (bool): See utils.openai_cache.cacheable; None caches temperature 0 requests only.
+            False also opts out of sharing an in-flight call.
+        tier (str): "premium", "regular" or "anonymous"; sets the priority when upstream calls queue.
+        org (str): The org the upstream token usage is recorded for; calls are only shared within an org.
+
+    Raises:
+        AdmissionRejected: Too many upstream calls are running and queued.
+        CircuitOpen: Upstream is failing for this model.
+        MalformedResponse: Upstream answered with something other than a chat completion.
+        PromptTooLong: The request does not fit the model's context window.
+        RateLimitExceeded: The request does not fit the upstream budget.
+        httpx.HTTPStatusError: Upstream rejected the request, after any retries.
+        httpx.TransportError: Upstream could not be reached or timed out, after any retries.
+    """
+    if not OPENAI_COALESCE or cache is False:
+        return await _call_openai_api(model, prompt, text, temperature, max_tokens, cache, tier, org)
+    key = (cache_key(model, SYSTEM_PROMPT, prompt, text, temperature, max_tokens), cache, tier, org)
+    result = await openai_flights.run(key, lambda: _call_openai_api(model, prompt, text, temperature, max_tokens,
+                                                                    cache, tier, org))
+    return dict(result)
+
+
+async def _batch_item(index: int, item_id, model: str, prompt: str, text: str, temperature: float,
+                      max_tokens: int, cache: bool, tier: str, org: str):
+    result = {"index": index}
+    if item_id is not None:
+        result["id"] = item_id
+    try:
+        result.update(await call_openai_api(model, prompt, text, temperature, max_tokens, cache=cache, tier=tier, org=org))
+    except (RateLimitExceeded, AdmissionRejected, CircuitOpen) as e:
+        result.update({"error": str(e), "retry_after": e.retry_after})
+    except PromptTooLong as e:
+        result["error"] = str(e)
+    except httpx.HTTPStatusError as e:
+        logger.error("Upstream error in batch item %s: %s", index, e)
+        result["error"] = f"The AI provider returned {e.response.status_code}."
+        if e.response.status_code == 429:
+            # Upstream is rate limiting, as when refused under load: the item may be resubmitted
+            retry_after = retry_after_seconds(e.response)
+            result.update({"error": "The AI provider is rate limiting requests. Try again later.",
+                           "retry_after": retry_after if retry_after is not None else 1})
+    except Exception as e:
+        logger.error("Error occurred in batch item %s: %s", index, e)
+        result["error"] = str(e)
+    return result
+
+
+async def batch_openai_api(model: str, items: list, temperature: float, max_tokens: int,
+                           concurrency: int = OPENAI_BATCH_CONCURRENCY, cache: bool = None, tier: str = "regular",
+                           org: str = ""):
+    """
+    Answers a batch of chat requests, running up to concurrency of them at a
+    time through call_openai_api, so each still goes through the cache,
+    coalescing, admission queue and retries.
+
+    Parameters:
+        items (list): (id, prompt, text) tuples; id may be None.
+        concurrency (int): Items of this batch in flight at once.
+
+    Yields:
+        dict: One result per item, in completion order, with the item's index (and id
+            if given) and either "response" or "error" (with "retry_after" when the
+            item was refused for load and may be resubmitted).
+    """
+    results = asyncio.Queue()
+    pending = iter(enumerate(items))
+
+    async def worker():
+        # Workers share one iterator, so each item is taken exactly once
+        for index, (item_id, prompt, text) in pending:
+            await results.put(await _batch_item(index, item_id, model, prompt, text, temperature,
+                                                max_tokens, cache, tier, org))
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, min(concurrency, len(items))))]
+    try:
+        for _ in range(len(items)):
+            yield await results.get()
+    finally:
+        # The caller stopped early (e.g. the client disconnected): drop the remaining items
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+async def _call_openai_api(model: str, prompt: str, text: str, temperature: float, max_tokens: int,
+                           cache: bool = None, tier: str = "regular", org: str = ""):
+    data, input_tokens = _chat_request(model, prompt, text, temperature, max_tokens)
+    key, ai_content = await _cached_response(model, prompt, text, temperature, max_tokens, cache)
+    if ai_content is not None:
+        return {"response": ai_content}
+    async with openai_admission.slot(tier):
+        return await _post_chat(data, input_tokens, key, org)
+
+
+async def _post_chat(data: dict, input_tokens: int, key: str = None, org: str = ""):
+    # Raises RateLimitExceeded rather than sending a request upstream would reject
+    await openai_budget.acquire(input_tokens + data["max_tokens"])
+    response = await _send_chat(data)
+    try:
+        result = response.json()
+        ai_content = result["choices"][0]["message"]["content"].strip()
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+        logger.error("Malformed response from AI (%s): %.500s", e, response.text)
+        raise MalformedResponse(f"Upstream returned a malformed response: {e!r}") from e
+    _record_usage(org, data, result.get("usage"), input_tokens, ai_content)
+    logger.debug("Response from AI of %s characters", len(ai_content))
+    logger.debug("Response from AI: %s", ai_content)
+    if key:
+        await response_cache.put(key, ai_content)
+    return {"response": ai_content}
+
+
+class MalformedResponse(Exception):
+    """
+    Raised when upstream answers 200 with a body that is not a chat completion.
+    """
+
+
+class DeltaStream:
+    """
+    The content deltas of a streamed completion. aclose() closes the
+    upstream response and frees its upstream call slot; it runs when
+    iteration ends or fails, and can be called again safely, e.g. from a
+    response background task in case the body is never iterated.
+    """
+
+    def __init__(self, deltas, cleanup=None):
+        self._deltas = deltas
+        self._cleanup = cleanup
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._deltas.__anext__()
+        except BaseException:
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await self._deltas.aclose()
+        finally:
+            if self._cleanup:
+                await self._cleanup()
+
+
+async def stream_openai_api(model: str, prompt: str, text: str, temperature: float, max_tokens: int,
+                            cache: bool = None, tier: str = "regular", org: str = ""):
+    """
+    Starts a streamed completion and returns once upstream has accepted it,
+    so that errors before the first token can still become a normal response.
+    A cached response is sent as a single delta; a completed stream is cached.
+    The upstream call slot is held until the stream is closed.
+
+    Parameters:
+        cache (bool): See utils.openai_cache.cacheable; None caches temperature 0 requests only.
+        tier (str): "premium", "regular" or "anonymous"; sets the priority when upstream calls queue.
+        org (str): The org the upstream token usage is recorded for.
+
+    Returns:
+        DeltaStream: The content deltas as upstream sends them.
+
+    Raises:
+        AdmissionRejected: Too many upstream calls are running and queued.
+        CircuitOpen: Upstream is failing for this model.
+        PromptTooLong: The request does not fit the model's context window.
+        RateLimitExceeded: The request does not fit the upstream budget.
+        httpx.HTTPError: Upstream could not be reached or rejected the request.
+    """
+    data, input_tokens = _chat_request(model, prompt, text, temperature, max_tokens, stream=True)
+    key, ai_content = await _cached_response(model, prompt, text, temperature, max_tokens, cache)
+    if ai_content is not None:
+        return DeltaStream(_iter_cached(ai_content))
+
+    await openai_admission.acquire(tier)
+    try:
+        await openai_budget.acquire(input_tokens + max_tokens)
+        response = await _send_chat(data, stream=True)
+    except BaseException:
+        openai_admission.release()
+        raise
+
+    async def cleanup():
+        try:
+            await response.aclose()
+        finally:
+            openai_admission.release()
+    return DeltaStream(_iter_deltas(response, key, data, input_tokens, org), cleanup)
+
+
+async def _iter_cached(ai_content: str):
+    yield ai_content
+
+
+async def _iter_deltas(response: httpx.Response, key: str, data: dict, input_tokens: int, org: str):
+    # Upstream sends "data: {chunk}" lines, the last with the usage, and ends with "data: [DONE]"
+    parts = []
+    usage = None
+    try:
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            payload = line[5:].strip()
+            if payload == "[DONE]":
+                # Only complete responses are cached, matching the stripped non-streamed text
+                if key:
+                    await response_cache.put(key, "".join(parts).strip())
+                break
+            chunk = json.loads(payload)
+            usage = chunk.get("usage") or usage
+            choices = chunk.get("choices") or []
+            delta = choices[0].get("delta", {}).get("content") if choices else None
+            if delta:
+                parts.append(delta)
+                yield delta
+    finally:
+        ai_content = "".join(parts)
+        # Recorded even when the client left early: upstream charges for what it generated
+        _record_usage(org, data, usage, input_tokens, ai_content)
+        logger.debug("Streamed response from AI of %s characters", len(ai_content))
+        logger.debug("Response from AI: %s", ai_content)
+
+
+async def iter_sse(deltas):
+    """
+    Encodes content deltas as server-sent events: one data: {"delta": ...}
+    event per delta, an error event if the stream breaks, and data: [DONE] at the end.
+    """
+    try:
+        async for delta in deltas:
+            yield f"data: {json.dumps({'delta': delta})}\n\n".encode()
     except Exception as e:
-        logger.error(f"Error occurred: {e}")
-        return {"error": str(e)}
+        logger.error("Error occurred while streaming: %s", e)
+        yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n".encode()
+        return
+    yield b"data: [DONE]\n\n"
+
+
+async def iter_ndjson(deltas):
+    """
+    Encodes content deltas as NDJSON: one {"delta": ...} line per delta,
+    an {"error": ...} line if the stream breaks, and {"done": true} at the end.
+    """
+    try:
+        async for delta in deltas:
+            yield (json.dumps({"delta": delta}) + "\n").encode()
+    except Exception as e:
+        logger.error("Error occurred while streaming: %s", e)
+        yield (json.dumps({"error": str(e)}) + "\n").encode()
+        return
+    yield b'{"done": true}\n'
+
+
+async def iter_batch_ndjson(results):
+    """
+    Encodes batch results as NDJSON, one line per item, and {"done": true} at the end.
+    """
+    async for result in results:
+        yield (json.dumps(result) + "\n").encode()
+    yield b'{"done": true}\n'
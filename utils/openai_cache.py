@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+logger = logging.getLogger('openai_cache')
+
+load_dotenv()
+# Responses are only cached when OPENAI_CACHE_ENABLED is set
+OPENAI_CACHE_ENABLED = os.getenv("OPENAI_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+OPENAI_CACHE_TTL = float(os.getenv("OPENAI_CACHE_TTL", "86400"))
+# Entries kept in memory per worker; the SQLite file at OPENAI_CACHE_PATH is shared by all workers on the host
+OPENAI_CACHE_MAX_ENTRIES = int(os.getenv("OPENAI_CACHE_MAX_ENTRIES", "1000"))
+OPENAI_CACHE_PATH = os.getenv("OPENAI_CACHE_PATH", "openai_cache.db")
+
+# Expired rows are deleted from disk once every this many stores
+PURGE_EVERY = 1000
+
+
+def cache_key(model: str, system_prompt: str, prompt: str, text: str, temperature: float, max_tokens: int):
+    """
+    Hashes a chat request after normalizing it: the model is lowercased,
+    runs of whitespace in the prompts and text become single spaces and the
+    temperature is rounded, so trivially different resubmissions share a key.
+
+    Returns:
+        str: A hex SHA-256 digest.
+    """
+    normalized = {
+        "model": model.strip().lower(),
+        "system": " ".join(system_prompt.split()),
+        "prompt": " ".join(prompt.split()),
+        "text": " ".join(text.split()),
+        "temperature": round(float(temperature), 3),
+        "max_tokens": int(max_tokens),
+    }
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache of AI responses by request key: an LRU dict in memory in
+    front of a SQLite table on disk. Entries expire ttl seconds after they
+    are stored. Disk reads and writes run on a worker thread so they do not
+    block the event loop.
+
+    Parameters:
+        max_entries (int): Entries kept in memory.
+        ttl (float): Seconds an entry stays valid.
+        path (str): SQLite file of the disk tier; empty for memory only.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 86400, path: str = ""):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self._entries = OrderedDict()  # key -> (expires_at, response)
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._stores = 0
+        self.metrics = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def _connection(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, expires_at REAL NOT NULL, response TEXT NOT NULL)"
+            )
+        return self._db
+
+    def _remember(self, key: str, expires_at: float, response: str):
+        with self._lock:
+            self._entries[key] = (expires_at, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.metrics["evictions"] += 1
+
+    def _disk_get(self, key: str):
+        with self._db_lock:
+            return self._connection().execute(
+                "SELECT expires_at, response FROM responses WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+
+    def _disk_put(self, key: str, expires_at: float, response: str, purge: bool):
+        with self._db_lock:
+            db = self._connection()
+            db.execute("INSERT OR REPLACE INTO responses (key, expires_at, response) VALUES (?, ?, ?)",
+                       (key, expires_at, response))
+            if purge:
+                db.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+
+    async def get(self, key: str):
+        """
+        Returns:
+            tuple[str, str] | tuple[None, None]: The cached response and the tier
+                it came from ("memory" or "disk"), or (None, None) on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.metrics["memory_hits"] += 1
+                return entry[1], "memory"
+            if entry:
+                del self._entries[key]
+
+        if self.path:
+            try:
+                row = await asyncio.to_thread(self._disk_get, key)
+            except sqlite3.Error as e:
+                logger.error("Error reading the OpenAI response cache: %s", e)
+                row = None
+            if row:
+                self._remember(key, *row)
+                self.metrics["disk_hits"] += 1
+                return row[1], "disk"
+
+        self.metrics["misses"] += 1
+        return None, None
+
+    async def put(self, key: str, response: str):
+        expires_at = time.time() + self.ttl
+        self._remember(key, expires_at, response)
+        self.metrics["stores"] += 1
+        if self.path:
+            self._stores += 1
+            try:
+                await asyncio.to_thread(self._disk_put, key, expires_at, response, self._stores % PURGE_EVERY == 0)
+            except sqlite3.Error as e:
+                logger.error("Error writing the OpenAI response cache: %s", e)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Hit, miss, store and eviction counts, the hit ratio and the number of entries in memory.
+        """
+        metrics = dict(self.metrics)
+        lookups = metrics["memory_hits"] + metrics["disk_hits"] + metrics["misses"]
+        metrics["hit_ratio"] = round((metrics["memory_hits"] + metrics["disk_hits"]) / lookups, 4) if lookups else 0.0
+        metrics["memory_entries"] = len(self._entries)
+        return metrics
+
+
+response_cache = ResponseCache(OPENAI_CACHE_MAX_ENTRIES, OPENAI_CACHE_TTL, OPENAI_CACHE_PATH) if OPENAI_CACHE_ENABLED else None
+
+
+def cacheable(temperature: float, cache: bool = None):
+    """
+    Whether a request may be answered from, and stored in, the cache.
+
+    Parameters:
+        temperature (float): The request's temperature.
+        cache (bool): The request's choice: None caches only deterministic
+            (temperature 0) requests, True allows any temperature, False bypasses the cache.
+    """
+    if response_cache is None or cache is False:
+        return False
+    return cache is True or temperature == 0
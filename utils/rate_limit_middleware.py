@@ -0,0 +1,92 @@
+import json
+import math
+import logging
+from starlette.requests import Request
+from starlette.routing import Match
+from utils.limiter import RateLimitPolicy, acheck_policies
+
+logger = logging.getLogger('limiter')
+
+
+def match_route(scope):
+    """
+    Finds the route a request will be dispatched to, without dispatching it.
+
+    Returns:
+        tuple[BaseRoute, dict] | tuple[None, None]: The route and the scope values
+            routing would add (path_params, endpoint).
+    """
+    app = scope.get("app")
+    for route in getattr(app, "routes", ()):
+        match, child_scope = route.matches(scope)
+        if match == Match.FULL:
+            return route, child_scope
+    return None, None
+
+
+def _headers(policy: RateLimitPolicy, result):
+    return [
+        (b"ratelimit-limit", str(policy.max_requests).encode()),
+        (b"ratelimit-remaining", str(result.remaining).encode()),
+        (b"ratelimit-reset", str(math.ceil(result.reset_after)).encode()),
+        (b"ratelimit-policy", f"{policy.max_requests};w={policy.time_window:g}".encode()),
+    ]
+
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware that applies rate limit policies per route.
+
+    The route is matched from the path alone, so a rejected request gets its
+    429 before the body is read, dependencies are resolved or a threadpool
+    thread is taken. Allowed responses carry RateLimit-* headers for the
+    tightest policy that applied.
+
+    Parameters:
+        app: The ASGI app to wrap.
+        policies (dict[str, list[RateLimitPolicy]]): Policies by route path template,
+            e.g. "/users/{user_id}". Key functions get the path parameters by name
+            plus the Request as "request".
+    """
+
+    def __init__(self, app, policies: dict[str, list[RateLimitPolicy]]):
+        self.app = app
+        self.policies = policies
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        route, child_scope = match_route(scope)
+        policies = self.policies.get(route.path) if route else None
+        if not policies:
+            return await self.app(scope, receive, send)
+
+        request = Request({**scope, **child_scope})
+        limited = await acheck_policies(policies, {**request.path_params, "request": request})
+        if limited is None:
+            return await self.app(scope, receive, send)
+
+        policy, result = limited
+        headers = _headers(policy, result)
+        if not result.allowed:
+            logger.warning("Rate limit %s exceeded on %s.", policy.name, route.path)
+            body = json.dumps({"detail": "Rate limit exceeded. Try again later."}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": headers + [
+                    (b"retry-after", str(math.ceil(result.retry_after)).encode()),
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": list(message.get("headers", [])) + headers}
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
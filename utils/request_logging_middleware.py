@@ -0,0 +1,58 @@
+import time
+import uuid
+import logging
+from utils.logger import request_context
+from utils.rate_limit_middleware import match_route
+
+logger = logging.getLogger('px.request')
+
+
+class RequestLoggingMiddleware:
+    """
+    ASGI middleware that sets the log context of every request and logs one
+    summary line when it completes.
+
+    The context holds a request id (the X-Request-ID header if the client
+    sent one, otherwise a new one), the route template and the org path
+    parameter. Every record logged while handling the request carries it,
+    including records from db.manage_user and utils.openai_api, and
+    set_log_context() adds fields to it. The request id is returned in the
+    X-Request-ID response header.
+
+    Parameters:
+        app: The ASGI app to wrap.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        request_id = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex
+        route, child_scope = match_route(scope)
+        context = {"request_id": request_id, "route": route.path if route else scope["path"]}
+        org = child_scope.get("path_params", {}).get("org") if child_scope else None
+        if org:
+            context["org"] = org
+        token = request_context.set(context)
+        status = 500
+
+        async def send_with_request_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"x-request-id", request_id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            duration_ms = round((time.perf_counter() - started) * 1000, 2)
+            logger.info(
+                "%s %s %s in %.1f ms", scope["method"], context["route"], status, duration_ms,
+                extra={"method": scope["method"], "status": status, "duration_ms": duration_ms}
+            )
+            request_context.reset(token)
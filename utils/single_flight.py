@@ -0,0 +1,55 @@
+import asyncio
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls by key: the first caller starts the call as a
+    task, and callers arriving with the same key while it runs await that
+    task and get the same result or exception.
+
+    Each caller awaits the task through asyncio.shield, so a cancelled
+    caller (e.g. one whose client disconnected) only stops waiting, even if
+    it started the call. The task itself is cancelled once no caller is
+    waiting for it any more.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.metrics = {"calls": 0, "coalesced": 0}
+
+    async def run(self, key, call):
+        """
+        Parameters:
+            key: Identifies calls that are interchangeable.
+            call (callable): Returns the awaitable to run when no call with this key is in flight.
+
+        Returns:
+            The call's result.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(call()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda task: self._forget(key, flight))
+            self.metrics["calls"] += 1
+        else:
+            self.metrics["coalesced"] += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+                self._forget(key, flight)
+
+    def _forget(self, key, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
@@ -0,0 +1,127 @@
+import os
+import logging
+from functools import lru_cache
+from dotenv import load_dotenv
+
+try:
+    import tiktoken
+except ImportError:  # optional; counts fall back to about 4 characters per token
+    tiktoken = None
+
+logger = logging.getLogger('tokens')
+
+load_dotenv()
+# What to do with a request whose text does not fit the model's context window:
+# "reject" it before calling upstream, or "truncate" the text to fit
+OPENAI_CONTEXT_POLICY = os.getenv("OPENAI_CONTEXT_POLICY", "reject").lower()
+# Most input tokens sent per request, to bound its cost; 0 for the context window only
+OPENAI_MAX_INPUT_TOKENS = int(os.getenv("OPENAI_MAX_INPUT_TOKENS", "0"))
+# Context window of models not in CONTEXT_WINDOWS
+OPENAI_DEFAULT_CONTEXT_WINDOW = int(os.getenv("OPENAI_DEFAULT_CONTEXT_WINDOW", "128000"))
+
+# Context windows in tokens, by model name prefix; the longest matching prefix wins
+CONTEXT_WINDOWS = {
+    "gpt-4o": 128000,
+    "gpt-4.1": 1047576,
+    "gpt-4-turbo": 128000,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+    "o1": 200000,
+    "o3": 200000,
+    "o4-mini": 200000,
+}
+
+# Tokens the chat format adds: per message (role and separators) and to prime the reply
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+# Characters per token of the fallback estimate
+CHARACTERS_PER_TOKEN = 4
+
+
+class PromptTooLong(Exception):
+    """
+    Raised when a request's input does not fit the tokens allowed for it.
+    """
+
+    def __init__(self, message: str, tokens: int, limit: int):
+        super().__init__(message)
+        self.tokens = tokens
+        self.limit = limit
+
+
+@lru_cache(maxsize=32)
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str, model: str = "gpt-4o"):
+    """
+    Tokens of a text for the model: exact with tiktoken installed, otherwise
+    estimated at about 4 characters per token.
+    """
+    encoding = _encoding(model)
+    if encoding is None:
+        return len(text) // CHARACTERS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int, model: str = "gpt-4o"):
+    """
+    Returns:
+        str: The start of the text, at most max_tokens long.
+    """
+    if max_tokens <= 0:
+        return ""
+    encoding = _encoding(model)
+    if encoding is None:
+        return text[:(max_tokens - 1) * CHARACTERS_PER_TOKEN]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+
+def context_window(model: str):
+    matches = [prefix for prefix in CONTEXT_WINDOWS if model.startswith(prefix)]
+    return CONTEXT_WINDOWS[max(matches, key=len)] if matches else OPENAI_DEFAULT_CONTEXT_WINDOW
+
+
+def fit_input(model: str, system_prompt: str, prompt: str, text: str, max_tokens: int):
+    """
+    Checks that a chat request fits the model's context window with room for
+    max_tokens of reply, and OPENAI_MAX_INPUT_TOKENS if set. When it does not,
+    the text is truncated or the request rejected, per OPENAI_CONTEXT_POLICY.
+
+    Parameters:
+        system_prompt (str): The system message.
+        prompt (str): The user's instruction; never truncated.
+        text (str): The user's text; truncated first.
+
+    Returns:
+        tuple[str, int]: The text to send and the input tokens of the request.
+
+    Raises:
+        PromptTooLong: The request does not fit, and the policy is "reject" or even
+            the prompt alone is too long.
+    """
+    limit = context_window(model) - max_tokens
+    if OPENAI_MAX_INPUT_TOKENS:
+        limit = min(limit, OPENAI_MAX_INPUT_TOKENS)
+    overhead = 2 * TOKENS_PER_MESSAGE + TOKENS_PER_REPLY + count_tokens(system_prompt, model) + count_tokens(f"{prompt} : ", model)
+    text_tokens = count_tokens(text, model)
+    if overhead + text_tokens <= limit:
+        return text, overhead + text_tokens
+
+    if OPENAI_CONTEXT_POLICY != "truncate" or overhead >= limit:
+        raise PromptTooLong(
+            f"The request is {overhead + text_tokens} tokens, over the {limit} allowed for {model} "
+            f"with max_tokens {max_tokens}. Shorten the text or lower max_tokens.",
+            overhead + text_tokens, limit
+        )
+    text = truncate_tokens(text, limit - overhead, model)
+    logger.info("Truncated text from %s to %s tokens to fit %s.", text_tokens, limit - overhead, model)
+    return text, overhead + count_tokens(text, model)
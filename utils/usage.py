@@ -0,0 +1,98 @@
+import os
+import asyncio
+import logging
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+logger = logging.getLogger('usage')
+
+load_dotenv()
+# Seconds between writes of the usage counters to the database
+OPENAI_USAGE_FLUSH_SECONDS = float(os.getenv("OPENAI_USAGE_FLUSH_SECONDS", "60"))
+
+
+class UsageCounters:
+    """
+    Upstream token usage summed in memory per org, model and UTC day, and
+    written out every interval seconds as one batch, so recording a call
+    costs no database round-trip. Counts that fail to be written are kept
+    and retried with the next batch.
+
+    Parameters:
+        interval (float): Seconds between writes.
+    """
+
+    def __init__(self, interval: float = 60):
+        self.interval = interval
+        self._pending = {}  # (org, model, day) -> [requests, prompt_tokens, completion_tokens]
+        self._write = None
+        self._task = None
+        self.metrics = {"flushes": 0, "rows_written": 0, "failures": 0}
+
+    def record(self, org: str, model: str, prompt_tokens: int, completion_tokens: int):
+        key = (org or "", model, datetime.now(timezone.utc).date())
+        counts = self._pending.get(key)
+        if counts is None:
+            counts = self._pending[key] = [0, 0, 0]
+        counts[0] += 1
+        counts[1] += prompt_tokens
+        counts[2] += completion_tokens
+
+    def _merge(self, pending: dict):
+        for key, counts in pending.items():
+            current = self._pending.setdefault(key, [0, 0, 0])
+            for i, count in enumerate(counts):
+                current[i] += count
+
+    async def flush(self):
+        """
+        Writes the counts recorded since the last flush.
+        """
+        if not self._pending or self._write is None:
+            return
+        pending, self._pending = self._pending, {}
+        rows = [
+            {"org": org, "model": model, "day": day, "requests": requests, "prompt_tokens": prompt_tokens,
+             "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+            for (org, model, day), (requests, prompt_tokens, completion_tokens) in pending.items()
+        ]
+        try:
+            await asyncio.to_thread(self._write, rows)
+        except Exception as e:
+            self._merge(pending)
+            self.metrics["failures"] += 1
+            logger.error("Error writing %s usage rows, keeping them for the next flush: %s", len(rows), e)
+            return
+        self.metrics["flushes"] += 1
+        self.metrics["rows_written"] += len(rows)
+
+    def start(self, write):
+        """
+        Starts flushing every interval seconds.
+
+        Parameters:
+            write (callable): Stores a list of row dicts; called on a worker thread.
+        """
+        self._write = write
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stops the periodic flush and writes what is left.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def stats(self):
+        return {**self.metrics, "pending_rows": len(self._pending)}
+
+
+openai_usage = UsageCounters(OPENAI_USAGE_FLUSH_SECONDS)